@@ -0,0 +1,335 @@
+from flask import Response, request, stream_with_context, jsonify
+import pandas as pd
+import pyarrow as pa
+import io
+import re
+import time
+
+from clean_data import FLAG_COLUMNS, QC_POLICIES, SEASONAL_SERIES, decode_flags
+from map_payload import MAP_PAYLOAD_URL
+from nearest_stations import nearest_stations
+from station_store import (STATION_FILE_SUFFIXES, MAX_CACHED_STATIONS, ensure_stations_data, iter_station_chunks,
+                           station_file, pin_stations, unpin_stations)
+
+# The 'api.py' module adds plain HTTP endpoints to the Flask server of the Dash app.
+#
+# /export?stations=ID1,ID2&kind=yearly&from=1950&to=2024&format=csv&qc=none
+#   Streams the raw, monthly, yearly or seasonal data of one or more stations.
+#   'qc' is the quality control policy (see QC_POLICIES in 'clean_data.py').
+#   The files are read chunk by chunk and every chunk is sent as soon as it is
+#   converted, so the memory use doesn't grow with the size of the export.
+#   'format' is either 'csv' or 'arrow' (Arrow IPC stream), both with the columns
+#   of EXPORT_SCHEMAS. The stations are pinned in the cache and their files are
+#   opened before the response starts, so they can't be removed during the stream.
+#
+# /station-map-payload
+#   The precompressed station layer of the map (see 'map_payload.py'), sent with
+#   brotli or gzip and an ETag, so repeat visits only get a '304 Not Modified'.
+#
+# /nearest?radius=50&k=5&from=1961&to=1990&coverage=80&format=json   (POST)
+#   The k nearest stations within the radius for many coordinates at once (see
+#   'nearest_stations.py'). The body is either JSON {"points": [[lat, lon], ...]}
+#   (the parameters can also be given in the JSON object) or a CSV file with the
+#   columns 'lat' and 'lon'. 'format' is 'json' or 'csv', one row per match.
+#   'Coverage_Measured' is false if the coverage is only estimated from the inventory.
+#   The throughput is sent in the header 'X-Points-Per-Second'.
+
+# GHCN station IDs consist of 11 letters and digits
+STATION_ID_PATTERN = re.compile(r'^[A-Z0-9]{11}$')
+
+# Limits of the /nearest endpoint
+MAX_NEAREST_POINTS = 100000
+MAX_NEAREST_K = 100
+MAX_NEAREST_RADIUS_KM = 1000
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+
+
+# Columns and types of the exported data of every kind
+EXPORT_SCHEMAS = {
+    'raw': pa.schema([
+        ('Station_ID', pa.string()), ('Year', pa.int64()), ('Month', pa.int64()), ('Day', pa.int64()),
+        ('Element', pa.string()), ('Value', pa.float64()),
+        ('QFlag', pa.uint8()), ('MFlag', pa.uint8()), ('SFlag', pa.uint8())
+    ]),
+    'monthly': pa.schema([
+        ('Station_ID', pa.string()), ('Year', pa.int64()), ('Month', pa.int64()),
+        ('TMAX', pa.float64()), ('TMIN', pa.float64())
+    ]),
+    'yearly': pa.schema([
+        ('Station_ID', pa.string()), ('Year', pa.int64()), ('TMAX', pa.float64()), ('TMIN', pa.float64())
+    ]),
+    'seasonal': pa.schema(
+        [('Station_ID', pa.string()), ('Year', pa.int64())] +
+        [(series, pa.float64()) for series in SEASONAL_SERIES] +
+        [field for series in SEASONAL_SERIES
+         for field in [(f"{series}_sum", pa.float64()), (f"{series}_count", pa.int64())]]
+    )
+}
+
+
+class _ChunkSink:
+    """
+    Minimal writable file object for the Arrow stream writer.
+    Everything written since the last call of take() is collected, so the
+    bytes can be sent to the client batch by batch.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self.buffers = []
+
+    def write(self, data):
+        self.buffers.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.buffers)
+        self.buffers = []
+        return data
+
+
+def _csv_chunks(files, kind, year_from, year_to, qc_policy):
+    """
+    Yields the CSV export chunk by chunk, the header is only written once.
+    The flags of the raw data are written as characters like in the NOAA files.
+    """
+    columns = EXPORT_SCHEMAS[kind].names
+    yield ','.join(columns) + '\n'
+    for station_id, file in files.items():
+        for chunk in iter_station_chunks(station_id, kind, year_from, year_to, qc_policy, file=file):
+            chunk = chunk.reindex(columns=columns)
+            if kind == 'raw':
+                for column in FLAG_COLUMNS:
+                    chunk[column] = decode_flags(chunk[column])
+            yield chunk.to_csv(index=False, header=False)
+
+
+def _arrow_chunks(files, kind, year_from, year_to, qc_policy):
+    """
+    Yields the Arrow IPC stream, one record batch per chunk.
+    """
+    sink = _ChunkSink()
+    schema = EXPORT_SCHEMAS[kind]
+    writer = pa.ipc.new_stream(sink, schema)
+    for station_id, file in files.items():
+        for chunk in iter_station_chunks(station_id, kind, year_from, year_to, qc_policy, file=file):
+            chunk = chunk.reindex(columns=schema.names)
+            writer.write_batch(pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield sink.take()
+
+    writer.close()
+    yield sink.take()
+
+
+def register_export_route(server):
+    """
+    Adds the /export endpoint to the Flask server.
+
+    Args:
+        server (flask.Flask): The Flask server of the Dash app
+    """
+
+    @server.route('/export')
+    def export_station_data():
+        station_ids = [s.strip() for s in request.args.get('stations', '').split(',') if s.strip()]
+        kind = request.args.get('kind', 'yearly')
+        export_format = request.args.get('format', 'csv')
+        qc_policy = request.args.get('qc', 'none')
+
+        # Validate the parameters
+        if not station_ids:
+            return Response("Parameter 'stations' is missing", status=400)
+        invalid = [station_id for station_id in station_ids if not STATION_ID_PATTERN.match(station_id)]
+        if invalid:
+            return Response(f"Invalid station ID(s) {', '.join(invalid)}", status=400)
+        if len(station_ids) > MAX_CACHED_STATIONS:
+            return Response(f"At most {MAX_CACHED_STATIONS} stations can be exported at once", status=400)
+        if kind not in STATION_FILE_SUFFIXES:
+            return Response(f"Unknown kind '{kind}', use one of {', '.join(STATION_FILE_SUFFIXES)}", status=400)
+        if export_format not in EXPORT_FORMATS:
+            return Response(f"Unknown format '{export_format}', use one of {', '.join(EXPORT_FORMATS)}", status=400)
+        if qc_policy not in QC_POLICIES:
+            return Response(f"Unknown qc policy '{qc_policy}', use one of {', '.join(QC_POLICIES)}", status=400)
+        try:
+            year_from = int(request.args.get('from', 0))
+            year_to = int(request.args.get('to', 9999))
+        except ValueError:
+            return Response("Parameters 'from' and 'to' must be years", status=400)
+
+        # Download and process stations that are not cached yet. They stay pinned until
+        # the response is closed, and the open files can still be read if another
+        # process removes or refreshes them.
+        station_ids = list(dict.fromkeys(station_ids))
+        pin_stations(station_ids)
+        files = {}
+
+        def close_export():
+            for file in files.values():
+                file.close()
+            unpin_stations(station_ids)
+
+        try:
+            available = ensure_stations_data(station_ids, qc_policy)
+            missing = [station_id for station_id in station_ids if station_id not in available]
+            if missing:
+                close_export()
+                return Response(f"No data for station(s) {', '.join(missing)}", status=404)
+            for station_id in station_ids:
+                files[station_id] = open(station_file(station_id, kind, qc_policy), 'r')
+        except OSError as e:
+            close_export()
+            return Response(f"Station data not available: {e}", status=503)
+        except Exception as e:
+            # The stations must not stay pinned, otherwise they are never removed from the cache
+            close_export()
+            print(f"Error preparing the export of {', '.join(station_ids)}: {e}")
+            return Response("Error preparing the export", status=500)
+
+        if export_format == 'csv':
+            chunks = _csv_chunks(files, kind, year_from, year_to, qc_policy)
+        else:
+            chunks = _arrow_chunks(files, kind, year_from, year_to, qc_policy)
+
+        filename = f"{'_'.join(station_ids)}_{kind}_{year_from}-{year_to}.{export_format}"
+        response = Response(
+            stream_with_context(chunks),
+            mimetype=EXPORT_FORMATS[export_format],
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
+        response.call_on_close(close_export)
+        return response
+
+
+def register_map_route(server, get_payload):
+    """
+    Adds the /station-map-payload endpoint to the Flask server.
+
+    Args:
+        server (flask.Flask): The Flask server of the Dash app
+        get_payload (callable): Returns the current payload of build_map_payload()
+    """
+    @server.route(MAP_PAYLOAD_URL)
+    def station_map_payload():
+        payload = get_payload()
+
+        if request.if_none_match.contains(payload['etag']):
+            response = Response(status=304)
+        elif payload['br'] is not None and 'br' in request.accept_encodings:
+            response = Response(payload['br'], mimetype='application/octet-stream')
+            response.headers['Content-Encoding'] = 'br'
+        elif 'gzip' in request.accept_encodings:
+            response = Response(payload['gzip'], mimetype='application/octet-stream')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(payload['identity'], mimetype='application/octet-stream')
+
+        # The catalog can be refreshed, so the browser has to check the ETag every time
+        response.set_etag(payload['etag'])
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+
+def _nearest_request():
+    """
+    Reads the points and parameters of a /nearest request.
+
+    Returns:
+        tuple: (points as DataFrame with 'lat' and 'lon', parameters as dict)
+    """
+    parameters = dict(request.args)
+    if request.is_json:
+        body = request.get_json()
+        if isinstance(body, list):
+            body = {'points': body}
+        if not isinstance(body, dict):
+            raise ValueError("The JSON body must be an object with 'points'")
+        parameters.update({key: value for key, value in body.items() if key != 'points'})
+        points = body.get('points') or []
+        if points and isinstance(points[0], dict):
+            points = pd.DataFrame(points).reindex(columns=['lat', 'lon'])
+        else:
+            points = pd.DataFrame(points, columns=['lat', 'lon'])
+    else:
+        data = request.files['file'].read() if 'file' in request.files else request.get_data()
+        points = pd.read_csv(io.BytesIO(data)) if data.strip() else pd.DataFrame(columns=['lat', 'lon'])
+        points.columns = [str(column).strip().lower() for column in points.columns]
+        if 'lat' not in points.columns or 'lon' not in points.columns:
+            raise ValueError("The CSV file needs the columns 'lat' and 'lon'")
+
+    return points[['lat', 'lon']].apply(pd.to_numeric, errors='coerce'), parameters
+
+
+def register_nearest_route(server, get_catalog):
+    """
+    Adds the /nearest endpoint to the Flask server.
+
+    Args:
+        server (flask.Flask): The Flask server of the Dash app
+        get_catalog (callable): Returns the station catalog, its coverage bitsets and which
+                                of them are measured (see 'year_coverage.py')
+    """
+
+    @server.route('/nearest', methods=['POST'])
+    def nearest_station_lookup():
+        try:
+            points, parameters = _nearest_request()
+        except (ValueError, TypeError, pd.errors.ParserError) as e:
+            return Response(f"Invalid points: {e}", status=400)
+
+        # Validate the parameters
+        try:
+            radius = float(parameters.get('radius', 50))
+            k = int(parameters.get('k', 5))
+            year_from = int(parameters.get('from', 0))
+            year_to = int(parameters.get('to', 9999))
+            min_coverage = float(parameters.get('coverage', 0))
+        except (ValueError, TypeError):
+            return Response("Parameters 'radius', 'k', 'from', 'to' and 'coverage' must be numbers", status=400)
+        response_format = str(parameters.get('format', 'json'))
+
+        if points.empty:
+            return Response("No points given", status=400)
+        if len(points) > MAX_NEAREST_POINTS:
+            return Response(f"At most {MAX_NEAREST_POINTS} points can be looked up at once", status=400)
+        invalid = points.index[~(points['lat'].between(-90, 90) & points['lon'].between(-180, 180))]
+        if len(invalid):
+            return Response(f"Invalid coordinates in point(s) {', '.join(map(str, invalid[:10]))}", status=400)
+        if not 0 < radius <= MAX_NEAREST_RADIUS_KM:
+            return Response(f"'radius' must be between 0 and {MAX_NEAREST_RADIUS_KM} km", status=400)
+        if not 1 <= k <= MAX_NEAREST_K:
+            return Response(f"'k' must be between 1 and {MAX_NEAREST_K}", status=400)
+        if not 0 <= min_coverage <= 100:
+            return Response("'coverage' must be between 0 and 100", status=400)
+        if response_format not in ('json', 'csv'):
+            return Response(f"Unknown format '{response_format}', use json or csv", status=400)
+
+        stations, coverage_bits, measured = get_catalog()
+        start_time = time.perf_counter()
+        matches = nearest_stations(points.values, stations, coverage_bits, radius, k,
+                                   year_from, year_to, min_coverage, measured)
+        seconds = time.perf_counter() - start_time
+        points_per_second = round(len(points) / max(seconds, 1e-9))
+        headers = {'X-Points-Per-Second': str(points_per_second)}
+
+        if response_format == 'csv':
+            return Response(matches.to_csv(index=False), mimetype='text/csv', headers={
+                **headers, 'Content-Disposition': 'attachment; filename="nearest_stations.csv"'
+            })
+
+        response = jsonify({
+            'points': len(points),
+            'seconds': round(seconds, 4),
+            'points_per_second': points_per_second,
+            'matches': matches.to_dict('records')
+        })
+        response.headers.update(headers)
+        return response
@@ -1,144 +1,222 @@
 import pandas as pd
+import numpy as np
 import os.path
 
+from year_coverage import build_catalog_coverage, save_coverage
+from profiling import profiled
+
 # The 'clean_data.py' script is using the files downloaded from the 'data_loader.py' script
 # Firstly the files get converted, any unnecessary rows get filtered so only relevant
 # stations will be used. Only stations with TMAX and TMIN data are needed.
-# Upon creating the final file 'stations_inventory.csv' the temporary files will be removed
+# The downloaded 'stations.csv' is replaced by the final station catalog and the
+# temporary file 'inventory.txt' will be removed
 
 
 
-# Check if stations_inventory_merge.csv already exists
-if not os.path.isfile('./data/stations_inventory.csv'):
+def build_station_catalog(stations_file, inventory_file):
+    """
+    Builds the station catalog from the NOAA station list and inventory:
+    one row per station with TMAX or TMIN data, its coordinates, name and
+    the years in which both elements are available.
+    
+    Args:
+        stations_file (str): Path of the downloaded 'ghcnd-stations.csv'
+        inventory_file (str): Path of the downloaded 'ghcnd-inventory.txt'
+        
+    Returns:
+        pd.DataFrame: The catalog with the columns Station_ID, Latitude, Longitude,
+                      FirstYear, LastYear and Station_Name
+    """
     # Read the inventory file using space separator instead of fixed width
-    inventory_df = pd.read_csv('./data/inventory.txt', 
+    inventory_df = pd.read_csv(inventory_file, 
                               sep=r'\s+',            # Using raw string for whitespace separator
                               usecols=[0, 1, 2, 3, 4, 5],
                               names=['Station_ID', 'Latitude', 'Longitude', 'Element', 'FirstYear', 'LastYear'])
 
     # Filter rows to keep only TMAX and TMIN elements
     inventory_df = inventory_df[inventory_df['Element'].isin(['TMAX', 'TMIN'])]
-
-    # Display the first 5 rows of the filtered DataFrame
-    print("\nFirst 5 rows of the filtered inventory data:")
-    print("=" * 70)
-    print(inventory_df.head().to_string())
-    print("=" * 70)
-
-    # Save the filtered DataFrame to CSV
-    inventory_df.to_csv('./data/clean_inventory.csv', index=False)
-    print("\nSaved filtered data to clean_inventory.csv")
-else:
-    print("\nstations_inventory.csv already exists. Skipping processing.")
-
-
-
-
-# Check if stations_inventory_merge.csv already exists
-if not os.path.isfile('./data/stations_inventory.csv'):
-    # Read the clean inventory file
-    clean_inventory_df = pd.read_csv('./data/clean_inventory.csv')
+    inventory_df = inventory_df.drop_duplicates(subset=['Station_ID', 'Element'])
 
     # Read the stations file
-    stations_names_df = pd.read_csv('./data/stations.csv', 
+    stations_names_df = pd.read_csv(stations_file, 
                                    usecols=[0, 5],  # Only need Station_ID and Station_Name (column 5)
                                    names=['Station_ID', 'Station_Name'])
 
     # Merge the dataframes on Station_ID
-    stations_merge_df = pd.merge(stations_names_df, 
-                          clean_inventory_df, 
-                          on='Station_ID', 
-                          how='left')
-    
+    stations_inventory_df = pd.merge(inventory_df,
+                                     stations_names_df,
+                                     on='Station_ID',
+                                     how='left')
     
+    # Group by Station_ID and aggregate the data
+    stations_df = stations_inventory_df.groupby('Station_ID').agg({
+        'Latitude': 'first',  # Take first value since it is the same for each station
+        'Longitude': 'first', # Take first value since it is the same for each station
+        'FirstYear': 'max',   # Take the highest FirstYear
+        'LastYear': 'min',    # Take the lowest LastYear
+        'Station_Name': 'first' # Take first value since it is the same for each station
+    }).reset_index()
+
+    return stations_df
+
 
-    # Save to new CSV file
-    stations_merge_df.to_csv('./data/relevant_stations.csv', index=False)
+# The inventory only exists until the catalog was built from the downloaded files
+if os.path.isfile('./data/inventory.txt'):
+    stations_df = build_station_catalog('./data/stations.csv', './data/inventory.txt')
 
-    print("\nSaved relevant stations data to relevant_stations.csv")
+    # Display the first 5 rows of the catalog
+    print("\nFirst 5 rows of the station catalog:")
+    print("=" * 70)
+    print(stations_df.head().to_string())
+    print("=" * 70)
+
+    # Save the aggregated data to stations.csv
+    stations_df.to_csv('./data/stations.csv', index=False)
+    print("\nSaved aggregated station data to stations.csv")
+
+    # Save which years every station covers. Without a local mirror the years are estimated
+    # from the inventory until a station is downloaded or the refresher has read the bulk
+    # archive (COVERAGE_SOURCE=archive, see 'year_coverage.py')
+    bits, measured = build_catalog_coverage(stations_df)
+    save_coverage(stations_df['Station_ID'], bits, measured)
+    print(f"\nSaved year coverage to station_coverage.npz ({measured.sum()} of {len(measured)} stations exact)")
+    os.remove('./data/inventory.txt')
+    print("\nremoved temporary file inventory.txt")
 else:
-    print("\nstations_inventory.csv already exists. Skipping processing.")
+    print("\nstations.csv already processed. Skipping processing.")
 
+# Quality control policies: the quality flags (QFLAG) whose values are left out of the averages.
+# The flags are kept in the station file, so changing the policy only needs a new aggregation.
+#   D duplicate, G gap, I internal consistency, K streak, L multiday accumulation,
+#   M megaconsistency, N naught, O climatological outlier, R lagged range, S spatial consistency,
+#   T temporal consistency, W too warm for snow, X bounds, Z Datzilla investigation
+QC_POLICIES = {
+    'none': '',                  # Use all values
+    'outliers': 'GORSTX',        # Leave out values that failed a range or outlier check
+    'strict': 'DGIKLMNORSTWXZ'   # Leave out every value with a quality flag
+}
 
 
+# Flag columns of the cleaned station file
+FLAG_COLUMNS = ['QFlag', 'MFlag', 'SFlag']
 
 
-# Check if stations_inventory_merge.csv already exists
-if not os.path.isfile('./data/stations_inventory.csv'):
-    # Read the clean_inventory.csv file
-    clean_inventory_df = pd.read_csv('./data/clean_inventory.csv')
-    # Read the relevant_stations.csv file
-    relevant_stations_df = pd.read_csv('./data/relevant_stations.csv',
-                                    usecols= ['Station_ID', 'Station_Name'])
+def encode_flags(flags):
+    """
+    Encodes a column of one-character flags as uint8 codes.
+    A blank flag is 0, every other flag is its character code.
+    
+    Args:
+        flags (pd.Series): Flag characters
+        
+    Returns:
+        pd.Series: uint8 flag codes
+    """
+    flags = flags.fillna(' ').astype(str)
+    # Only the few distinct flags are converted in Python, the mapping itself is vectorized
+    codes = {flag: (ord(flag[0]) if flag.strip() else 0) for flag in flags.unique()}
+    return flags.map(codes).astype('uint8')
 
-    stations_inventory_merge_df = pd.merge(clean_inventory_df,
-                                           relevant_stations_df,
-                                           on='Station_ID',
-                                           how='left')
 
-    stations_inventory_merge_df = stations_inventory_merge_df.drop_duplicates(subset=['Station_ID', 'Element'])
+def decode_flags(codes):
+    """
+    Turns uint8 flag codes back into one-character flags, the opposite of encode_flags().
+    
+    Args:
+        codes (pd.Series): uint8 flag codes
+        
+    Returns:
+        pd.Series: Flag characters, empty for no flag
+    """
+    flags = {code: (chr(code) if code else '') for code in codes.unique()}
+    return codes.map(flags)
 
 
+def read_station_raw(source, usecols=None, chunksize=None):
+    """
+    Reads a cleaned station file with the flags as uint8 codes.
+    The file stores every flag as one character (empty if there is no flag).
+    
+    Args:
+        source (str or file object): Path or opened file of the station
+        usecols (list): Columns to read, all if None
+        chunksize (int): If given, the file is read in chunks of this many rows
+        
+    Returns:
+        pd.DataFrame: The station data, or an iterator of chunks if chunksize is given
+    """
+    # Blank flags are empty fields, they must not become NaN
+    reader = pd.read_csv(source, usecols=usecols, chunksize=chunksize,
+                         dtype={column: str for column in FLAG_COLUMNS}, keep_default_na=False)
+    
+    def decode(df):
+        for column in FLAG_COLUMNS:
+            if column in df.columns:
+                df[column] = encode_flags(df[column])
+        return df
+    
+    if chunksize is None:
+        return decode(reader)
+    return (decode(chunk) for chunk in reader)
 
-    # Save the merged DataFrame to CSV
-    stations_inventory_merge_df.to_csv('./data/stations_inventory.csv', index=False)
-    print("\nSaved filtered data to stations_inventory.csv")
-    os.remove('./data/inventory.txt')
-    print("\nremoved temporary file inventory.txt")
-    os.remove('./data/clean_inventory.csv')
-    print("\nremoved temporary file clean_inventory.csv")
-    os.remove('./data/stations.csv')
-    print("\nremoved temporary file stations.csv")
-    os.remove('./data/relevant_stations.csv')
-    print("\nremoved temporary file relevant_stations.csv")
-else:
-    print("\nstations_inventory.csv already exists. Skipping processing.")
 
-if not os.path.isfile('./data/stations.csv'):
-    # Read the stations inventory file
-    stations_inventory_df = pd.read_csv('./data/stations_inventory.csv',
-                                      usecols=['Station_ID', 'Latitude', 'Longitude', 'FirstYear', 'LastYear', 'Station_Name'])
+def qc_mask(df, qc_policy):
+    """
+    Returns a boolean mask of the values accepted by a quality control policy.
     
-    # Group by Station_ID and aggregate the data
-    stations_df = stations_inventory_df.groupby('Station_ID').agg({
-        'Latitude': 'first',  # Take first value since it is the same for each station
-        'Longitude': 'first', # Take first value since it is the same for each station
-        'FirstYear': 'max',   # Take the highest FirstYear
-        'LastYear': 'min',    # Take the lowest LastYear
-        'Station_Name': 'first' # Take first value since it is the same for each station
-    }).reset_index()
+    Args:
+        df (pd.DataFrame): Cleaned station data with a 'QFlag' column
+        qc_policy (str): Name of a policy in QC_POLICIES
+        
+    Returns:
+        np.ndarray: True for every value that is used
+    """
+    excluded_codes = [ord(flag) for flag in QC_POLICIES[qc_policy]]
+    return ~np.isin(df['QFlag'].values, excluded_codes)
 
-    # Save the aggregated data to stations.csv
-    stations_df.to_csv('./data/stations.csv', index=False)
-    print("\nSaved aggregated station data to stations.csv")
-    os.remove('./data/stations_inventory.csv')
-    print("\nremoved temporary file stations_inventory.csv")
 
-def clean_station_data(station_id):
+def qc_suffix(qc_policy):
+    """
+    Returns the file name suffix for the averages of a quality control policy.
+    The default policy 'none' has no suffix.
+    """
+    return '' if qc_policy == 'none' else f"_{qc_policy}"
+
+
+@profiled()
+def clean_station_data(station_id, station_dir="./data/stations"):
     """
     Cleans the station data by:
     1. Filtering for TMAX and TMIN elements
     2. Converting temperature from tenths of °C to °C with 2 decimal places
-    3. Removing flag columns
+    3. Storing the quality, measurement and source flags as single characters
+       (columns 'QFlag', 'MFlag' and 'SFlag', empty means no flag), read them
+       as uint8 codes with read_station_raw()
     
     Args:
         station_id (str): The station ID to clean data for
+        station_dir (str): Directory of the station files
         
     Returns:
         bool: True if successful, False if failed
     """
     try:
-        # Read the CSV file
-        input_file = f"./data/stations/{station_id}.csv"
-        df = pd.read_csv(input_file)
+        # Read the CSV file, the flags are kept as text (a blank flag is a space)
+        input_file = f"{station_dir}/{station_id}.csv"
+        df = pd.read_csv(input_file,
+                         dtype={'Quality_Flag': str, 'Measurement_Flag': str, 'Source_Flag': str},
+                         keep_default_na=False)
         
         # Filter for TMAX and TMIN elements
-        df = df[df['Element'].isin(['TMAX', 'TMIN'])]
+        df = df[df['Element'].isin(['TMAX', 'TMIN'])].copy()
         
         # Convert temperature from tenths of degrees to degrees Celsius
-        df['Value'] = df['Value'].apply(lambda x: round(x / 10.0, 2))
+        df['Value'] = (df['Value'] / 10.0).round(2)
         
-        # Remove flag columns
+        # Keep one character per flag, a blank flag is written as an empty field
+        df['QFlag'] = df['Quality_Flag'].str.strip().str[:1]
+        df['MFlag'] = df['Measurement_Flag'].str.strip().str[:1]
+        df['SFlag'] = df['Source_Flag'].str.strip().str[:1]
         df = df.drop(['Quality_Flag', 'Measurement_Flag', 'Source_Flag'], axis=1)
         
         # Save the cleaned data back to CSV
@@ -151,21 +229,30 @@ def clean_station_data(station_id):
         return False
 
 
-def create_monthly_averages(station_id):
+@profiled()
+def create_monthly_averages(station_id, qc_policy='none', station_dir="./data/stations"):
     """
     Creates a new CSV file with monthly averages for TMAX and TMIN values.
-    The new file will be named 'station_id_monthly.csv'.
+    Values rejected by the quality control policy are left out.
+    The new file will be named 'station_id_monthly.csv' (or e.g.
+    'station_id_monthly_strict.csv' for the policy 'strict').
     
     Args:
         station_id (str): The station ID to process
+        qc_policy (str): Name of a policy in QC_POLICIES
+        station_dir (str): Directory of the station files
         
     Returns:
         bool: True if successful, False if failed
     """
     try:
         # Read the cleaned station data
-        input_file = f"./data/stations/{station_id}.csv"
-        df = pd.read_csv(input_file)
+        input_file = f"{station_dir}/{station_id}.csv"
+        df = read_station_raw(input_file, usecols=['Year', 'Month', 'Element', 'Value', 'QFlag'])
+        
+        # Apply the quality control policy
+        if qc_policy != 'none':
+            df = df[qc_mask(df, qc_policy)]
         
         # Group by Year, Month, and Element to calculate monthly averages
         monthly_df = df.groupby(['Year', 'Month', 'Element'])['Value'].mean().round(2).reset_index()
@@ -184,10 +271,10 @@ def create_monthly_averages(station_id):
         monthly_df['Station_ID'] = station_id
         
         # Reorder columns to put Station_ID first
-        monthly_df = monthly_df[['Station_ID', 'Year', 'Month', 'TMAX', 'TMIN']]
+        monthly_df = monthly_df.reindex(columns=['Station_ID', 'Year', 'Month', 'TMAX', 'TMIN'])
         
         # Save to new CSV file
-        output_file = f"./data/stations/{station_id}_monthly.csv"
+        output_file = f"{station_dir}/{station_id}_monthly{qc_suffix(qc_policy)}.csv"
         monthly_df.to_csv(output_file, index=False)
         print(f"Successfully created monthly averages for station {station_id}")
         return True
@@ -198,21 +285,25 @@ def create_monthly_averages(station_id):
 
 
 
-def create_yearly_averages(station_id):
+@profiled()
+def create_yearly_averages(station_id, qc_policy='none', station_dir="./data/stations"):
     """
     Creates a new CSV file with yearly averages for TMAX and TMIN values,
     calculated from the monthly averages.
-    The new file will be named 'station_id_yearly.csv'.
+    The new file will be named 'station_id_yearly.csv' (with the suffix
+    of the quality control policy like the monthly file).
     
     Args:
         station_id (str): The station ID to process
+        qc_policy (str): Name of a policy in QC_POLICIES
+        station_dir (str): Directory of the station files
         
     Returns:
         bool: True if successful, False if failed
     """
     try:
         # Read the monthly averages file
-        input_file = f"./data/stations/{station_id}_monthly.csv"
+        input_file = f"{station_dir}/{station_id}_monthly{qc_suffix(qc_policy)}.csv"
         monthly_df = pd.read_csv(input_file)
         
         # Group by Year to calculate yearly averages
@@ -229,7 +320,7 @@ def create_yearly_averages(station_id):
         yearly_df = yearly_df[['Station_ID', 'Year', 'TMAX', 'TMIN']]
         
         # Save to new CSV file
-        output_file = f"./data/stations/{station_id}_yearly.csv"
+        output_file = f"{station_dir}/{station_id}_yearly{qc_suffix(qc_policy)}.csv"
         yearly_df.to_csv(output_file, index=False)
         print(f"Successfully created yearly averages for station {station_id}")
         return True
@@ -237,3 +328,86 @@ def create_yearly_averages(station_id):
     except Exception as e:
         print(f"Error creating yearly averages for station {station_id}: {e}")
         return False
+
+
+
+# Months belonging to each meteorological season. December is counted towards the
+# following year, so 'DJF' of 2020 is December 2019 + January/February 2020.
+# The seasons are stored by month group; main.py maps them to 'Winter', 'Sommer', ...
+# depending on the hemisphere of the station.
+SEASON_MONTHS = {
+    'DJF': [12, 1, 2],
+    'MAM': [3, 4, 5],
+    'JJA': [6, 7, 8],
+    'SON': [9, 10, 11]
+}
+
+# All series that get a prefix sum: the yearly values plus every season/element pair
+SEASONAL_SERIES = ['TMIN', 'TMAX'] + [f"{season}_{element}"
+                                      for season in SEASON_MONTHS
+                                      for element in ['TMIN', 'TMAX']]
+
+
+@profiled()
+def create_seasonal_sums(station_id, qc_policy='none', station_dir="./data/stations"):
+    """
+    Creates a new CSV file with one row per year containing the yearly and seasonal
+    averages for TMAX and TMIN, together with the cumulative sums and counts
+    (prefix sums) of every series.
+    The years are contiguous (missing years are empty rows), so the mean of any series
+    over a year window [a, b] can be read in constant time as
+    (sum[b] - sum[a-1]) / (count[b] - count[a-1]).
+    The new file will be named 'station_id_seasonal.csv' (with the suffix
+    of the quality control policy like the monthly file).
+    
+    Args:
+        station_id (str): The station ID to process
+        qc_policy (str): Name of a policy in QC_POLICIES
+        station_dir (str): Directory of the station files
+        
+    Returns:
+        bool: True if successful, False if failed
+    """
+    try:
+        # Read the monthly and yearly averages files
+        monthly_df = pd.read_csv(f"{station_dir}/{station_id}_monthly{qc_suffix(qc_policy)}.csv")
+        yearly_df = pd.read_csv(f"{station_dir}/{station_id}_yearly{qc_suffix(qc_policy)}.csv")
+        
+        # Assign every month to its season and count December towards the next year
+        month_to_season = {month: season
+                           for season, months in SEASON_MONTHS.items()
+                           for month in months}
+        monthly_df['Season'] = monthly_df['Month'].map(month_to_season)
+        monthly_df['Season_Year'] = monthly_df['Year'] + (monthly_df['Month'] == 12)
+        
+        # Calculate the seasonal averages and pivot them to one column per season/element
+        seasonal_df = monthly_df.groupby(['Season_Year', 'Season'])[['TMIN', 'TMAX']].mean().round(2)
+        seasonal_df = seasonal_df.unstack('Season')
+        seasonal_df.columns = [f"{season}_{element}" for element, season in seasonal_df.columns]
+        
+        # Combine with the yearly averages, only keeping years that have monthly data
+        seasonal_df = yearly_df.set_index('Year')[['TMIN', 'TMAX']].join(seasonal_df, how='left')
+        seasonal_df = seasonal_df.reindex(columns=SEASONAL_SERIES)
+        
+        # Make the years contiguous so a year can be used as a position
+        years = range(seasonal_df.index.min(), seasonal_df.index.max() + 1)
+        seasonal_df = seasonal_df.reindex(years)
+        seasonal_df.index.name = 'Year'
+        
+        # Add the prefix sums and counts for every series
+        for series in SEASONAL_SERIES:
+            seasonal_df[f"{series}_sum"] = seasonal_df[series].fillna(0).cumsum().round(2)
+            seasonal_df[f"{series}_count"] = seasonal_df[series].notna().cumsum()
+        
+        seasonal_df = seasonal_df.reset_index()
+        seasonal_df.insert(0, 'Station_ID', station_id)
+        
+        # Save to new CSV file
+        output_file = f"{station_dir}/{station_id}_seasonal{qc_suffix(qc_policy)}.csv"
+        seasonal_df.to_csv(output_file, index=False)
+        print(f"Successfully created seasonal sums for station {station_id}")
+        return True
+        
+    except Exception as e:
+        print(f"Error creating seasonal sums for station {station_id}: {e}")
+        return False
@@ -2,52 +2,70 @@ import requests
 import os
 import pandas as pd
 
-file_url_stations = "https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-stations.csv"
+from http_client import fetch, fetch_to_file, catalog_url, station_url
+from profiling import profiled
 
-r = requests.get(file_url_stations)
-if not os.path.exists("./data/stations.csv"):
-    with open("./data/stations.csv", "wb") as stations_txt:
-        stations_txt.write(r.content)
-    print("File 'stations.csv' successfully downloaded")
+def download_catalog_files(data_dir="./data"):
+    """
+    Downloads the NOAA station list as 'stations.csv' and the inventory as 'inventory.txt'.
+    Both files are downloaded to temporary files first and only moved into place when
+    both downloads succeeded, so a failed download never leaves 'stations.csv' behind
+    without the inventory (which would skip the catalog build on the next start).
     
-else:
-    print("File 'stations.csv' already exists")
+    Args:
+        data_dir (str): Directory the files are written to
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    downloads = [
+        (catalog_url("ghcnd-inventory.txt"), f"{data_dir}/inventory.txt"),
+        (catalog_url("ghcnd-stations.csv"), f"{data_dir}/stations.csv")
+    ]
+    try:
+        for url, output_file in downloads:
+            fetch_to_file(url, f"{output_file}.download")
+        
+        # 'stations.csv' is moved last, it marks the catalog as downloaded
+        for url, output_file in downloads:
+            os.replace(f"{output_file}.download", output_file)
+            print(f"File '{os.path.basename(output_file)}' successfully downloaded")
+    finally:
+        for url, output_file in downloads:
+            if os.path.exists(f"{output_file}.download"):
+                os.remove(f"{output_file}.download")
 
-file_url_inventory = "https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-inventory.txt"
 
-r = requests.get(file_url_inventory)
+# The catalog files are only downloaded if the station catalog 'stations.csv' doesn't exist yet.
+# 'clean_data.py' replaces the downloaded 'stations.csv' with the processed catalog
+# and removes 'inventory.txt', so both files are downloaded together.
 if not os.path.exists("./data/stations.csv"):
-    with open("./data/inventory.txt", "wb") as inventory_txt:
-        inventory_txt.write(r.content)
-    print("File 'inventory.txt' successfully downloaded")
-    
+    download_catalog_files()
 else:
-    print("File 'inventory.txt' already exists")
+    print("File 'stations.csv' already exists")
 
-def download_station_data(station_id):
+@profiled()
+def download_station_data(station_id, station_dir="./data/stations"):
     """
     Downloads and converts a station's .dly file to CSV format.
     
     Args:
         station_id (str): The station ID from the stations.csv file
+        station_dir (str): Directory the CSV file is written to
         
     Returns:
         bool: True if successful, False if failed
     """
-    base_url = "https://www.ncei.noaa.gov/pub/data/ghcn/daily/all/"
-    file_url = f"{base_url}{station_id}.dly"
+    file_url = station_url(station_id)
     
     try:
-        # Download the .dly file
-        r = requests.get(file_url)
-        r.raise_for_status()  # Raises an HTTPError if the status is 4xx, 5xx
+        # Download the .dly file (raises a RequestException if the download failed)
+        content = fetch(file_url)
         
         # Create data directory if it doesn't exist
-        os.makedirs("./data/stations", exist_ok=True)
+        os.makedirs(station_dir, exist_ok=True)
         
         # Parse the fixed-width format .dly file
         data = []
-        content = r.content.decode('utf-8').split('\n')
+        content = content.decode('utf-8').split('\n')
         
         for line in content:
             if len(line) < 269:  # Skip incomplete lines
@@ -88,7 +106,7 @@ def download_station_data(station_id):
         
         # Convert to DataFrame and save as CSV
         df = pd.DataFrame(data)
-        output_file = f"./data/stations/{station_id}.csv"
+        output_file = f"{station_dir}/{station_id}.csv"
         df.to_csv(output_file, index=False)
         print(f"Successfully downloaded and converted {station_id} data to CSV")
         return True
@@ -0,0 +1,76 @@
+import numpy as np
+
+# The 'downsample.py' module reduces long time series to a number of points that
+# fits the width of a graph, using Largest-Triangle-Three-Buckets (LTTB).
+# LTTB keeps the visual shape of the series (peaks and dips) much better than
+# taking every n-th point or averaging.
+
+
+def lttb(x, y, n_out):
+    """
+    Selects n_out points of a series with the Largest-Triangle-Three-Buckets algorithm.
+    The first and the last point are always kept; from every bucket in between the
+    point forming the largest triangle with the previously selected point and the
+    mean of the next bucket is selected.
+
+    Args:
+        x (np.ndarray): Ascending x values as numbers
+        y (np.ndarray): y values without NaN
+        n_out (int): Number of points to keep (at least 3)
+
+    Returns:
+        np.ndarray: Indices of the selected points
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # Bucket boundaries for the points between the first and the last one
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Mean of the next bucket (the last point for the last bucket)
+        if i < n_out - 3:
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            mean_x = x[next_start:next_end].mean()
+            mean_y = y[next_start:next_end].mean()
+        else:
+            mean_x, mean_y = x[-1], y[-1]
+
+        # Twice the triangle areas for all points of the bucket at once
+        areas = np.abs(
+            (x[previous] - mean_x) * (y[start:end] - y[previous]) -
+            (x[previous] - x[start:end]) * (mean_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+
+    return selected
+
+
+def downsample_series(dates, values, n_out):
+    """
+    Downsamples a time series for plotting. Missing values are removed first.
+
+    Args:
+        dates (np.ndarray): Ascending datetime64 values
+        values (np.ndarray): Values of the series
+        n_out (int): Maximum number of points
+
+    Returns:
+        tuple: (dates, values) of the selected points
+    """
+    valid = ~np.isnan(values)
+    dates, values = dates[valid], values[valid]
+    indices = lttb(dates.astype('datetime64[s]').astype(np.int64), values, n_out)
+    return dates[indices], values[indices]
@@ -0,0 +1,205 @@
+import requests
+import os
+import shutil
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+from email.utils import parsedate_to_datetime
+
+# The 'http_client.py' module is the only place where NOAA data is fetched.
+# All downloads share one requests.Session, so connections are kept alive and reused,
+# failed requests are retried with exponential backoff and responses are gzip-compressed.
+#
+# The source can be changed with the environment variable GHCN_BASE_URL, e.g. to a local
+# mirror ('http://mirror.local/ghcn/daily/') or to a directory ('file:///srv/ghcn/daily/').
+# The mirror needs the same layout as NOAA: 'ghcnd-stations.csv', 'ghcnd-inventory.txt'
+# and the '.dly' files in the subdirectory 'all/'.
+
+GHCN_BASE_URL = os.environ.get('GHCN_BASE_URL')
+
+if GHCN_BASE_URL:
+    CATALOG_BASE_URL = GHCN_BASE_URL.rstrip('/') + '/'
+    STATION_BASE_URL = CATALOG_BASE_URL + 'all/'
+else:
+    CATALOG_BASE_URL = "https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/"
+    STATION_BASE_URL = "https://www.ncei.noaa.gov/pub/data/ghcn/daily/all/"
+
+# Timeouts in seconds for connecting and for waiting on data
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 60))
+
+# Retries with a backoff of 0.5s, 1s, 2s, ... between the attempts
+MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 5))
+BACKOFF_FACTOR = 0.5
+
+# Number of connections kept open per host
+POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+
+
+def _create_session():
+    """
+    Creates the shared session with connection pooling and retries.
+    """
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET', 'HEAD']
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+    return session
+
+
+session = _create_session()
+
+
+def catalog_url(filename):
+    """
+    Returns the URL of a catalog file like 'ghcnd-stations.csv'.
+    """
+    return f"{CATALOG_BASE_URL}{filename}"
+
+
+def station_url(station_id):
+    """
+    Returns the URL of the '.dly' file of a station.
+    """
+    return f"{STATION_BASE_URL}{station_id}.dly"
+
+
+def _local_path(url):
+    """
+    Returns the local path of a 'file://' URL, None for other URLs.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme != 'file':
+        return None
+    return url2pathname(parsed.path)
+
+
+def fetch(url):
+    """
+    Downloads a file and returns its content.
+
+    Args:
+        url (str): HTTP(S) or 'file://' URL
+
+    Returns:
+        bytes: The (decompressed) content of the file
+
+    Raises:
+        requests.exceptions.RequestException: If the download failed
+    """
+    path = _local_path(url)
+    if path is not None:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError as e:
+            raise requests.exceptions.ConnectionError(f"Cannot read {path}: {e}")
+
+    r = session.get(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    r.raise_for_status()  # Raises an HTTPError if the status is 4xx, 5xx
+    return r.content
+
+
+def fetch_to_file(url, output_file):
+    """
+    Downloads a file directly to disk without holding it in memory.
+    The file is written to a temporary file first and then renamed, so
+    output_file is never left half-written.
+
+    Args:
+        url (str): HTTP(S) or 'file://' URL
+        output_file (str): Path of the file to write
+
+    Raises:
+        requests.exceptions.RequestException: If the download failed
+    """
+    temp_file = f"{output_file}.part"
+    path = _local_path(url)
+    try:
+        if path is not None:
+            try:
+                shutil.copyfile(path, temp_file)
+            except OSError as e:
+                raise requests.exceptions.ConnectionError(f"Cannot read {path}: {e}")
+        else:
+            with session.get(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=True) as r:
+                r.raise_for_status()
+                with open(temp_file, 'wb') as f:
+                    # iter_content decompresses gzip transfers on the fly
+                    for block in r.iter_content(chunk_size=1024 * 1024):
+                        f.write(block)
+        os.replace(temp_file, output_file)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+@contextmanager
+def open_stream(url):
+    """
+    Opens a file for reading while it is downloaded, e.g. a large archive that is
+    processed once and never stored on disk.
+
+    Args:
+        url (str): HTTP(S) or 'file://' URL
+
+    Yields:
+        file object: Binary stream of the file content
+
+    Raises:
+        requests.exceptions.RequestException: If the download failed
+    """
+    path = _local_path(url)
+    if path is not None:
+        try:
+            f = open(path, 'rb')
+        except OSError as e:
+            raise requests.exceptions.ConnectionError(f"Cannot read {path}: {e}")
+        with f:
+            yield f
+        return
+
+    # No 'Accept-Encoding', the archive is already compressed
+    with session.get(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=True,
+                     headers={'Accept-Encoding': 'identity'}) as r:
+        r.raise_for_status()
+        yield r.raw
+
+
+def remote_modified_time(url):
+    """
+    Returns the modification time of a remote file without downloading it,
+    using the 'Last-Modified' header of a HEAD request.
+
+    Args:
+        url (str): HTTP(S) or 'file://' URL
+
+    Returns:
+        float: POSIX timestamp, None if the server doesn't send the header
+
+    Raises:
+        requests.exceptions.RequestException: If the request failed
+    """
+    path = _local_path(url)
+    if path is not None:
+        try:
+            return os.path.getmtime(path)
+        except OSError as e:
+            raise requests.exceptions.ConnectionError(f"Cannot read {path}: {e}")
+
+    r = session.head(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), allow_redirects=True)
+    r.raise_for_status()
+    last_modified = r.headers.get('Last-Modified')
+    if last_modified is None:
+        return None
+    return parsedate_to_datetime(last_modified).timestamp()
@@ -0,0 +1,353 @@
+import argparse
+import gzip
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+# The 'load_test.py' script measures how many users the app can serve at the same time.
+# It has two commands:
+#
+#   serve-noaa  Starts a local stand-in for the NOAA server with synthetic station data.
+#               The catalog and the '.dly' files are generated on the fly (always the same
+#               for the same station) and every response is delayed by a configurable latency.
+#
+#   run         Replays the requests of simulated users against a running app: search,
+#               station table, station click (with the trend panel and the detail graph)
+#               and a change of the period. The requests are built from the callbacks the
+#               app publishes at '/_dash-dependencies', so they match the current layout.
+#               At the end the throughput and the p50/p95/p99 latency per callback are printed.
+#
+# Example with a fresh data directory:
+#   python load_test.py serve-noaa --port 8765 --latency 0.2
+#   GHCN_BASE_URL=http://localhost:8765/ python data_loader.py && python clean_data.py
+#   GHCN_BASE_URL=http://localhost:8765/ REFRESH_INTERVAL_HOURS=0 python main.py
+#   python load_test.py run --url http://localhost:8050 --users 20 --sessions 5
+
+# Region of the synthetic stations (and of the simulated searches)
+LAT_RANGE = (47.0, 55.0)
+LON_RANGE = (6.0, 15.0)
+
+# Callbacks of a user session, named by their output
+CALLBACK_NAMES = {
+    'selected-stations-store.data': 'search',
+    'station-data-table.children': 'station_table',
+    '..year-to.value...year-from.value..': 'validate_years',
+    'yearly-data-container.children': 'station_data',
+    'trend-container.children': 'trends',
+    'drilldown-graph.figure': 'drilldown'
+}
+
+
+def _station_rng(station_id):
+    # The same station always gets the same data
+    return np.random.default_rng(int(hashlib.md5(station_id.encode()).hexdigest()[:8], 16))
+
+
+def synthetic_catalog(n_stations, seed=0):
+    """
+    Creates the synthetic station list and inventory.
+
+    Returns:
+        tuple: (content of 'ghcnd-stations.csv', content of 'ghcnd-inventory.txt') as bytes
+    """
+    rng = np.random.default_rng(seed)
+    latitudes = rng.uniform(*LAT_RANGE, n_stations)
+    longitudes = rng.uniform(*LON_RANGE, n_stations)
+    first_years = rng.integers(1900, 1990, n_stations)
+    last_years = rng.integers(2010, 2025, n_stations)
+
+    stations, inventory = [], []
+    for i in range(n_stations):
+        station_id = f"LT{i:09d}"
+        stations.append(f"{station_id},{latitudes[i]:.4f},{longitudes[i]:.4f},100.0,,LOADTEST STATION {i},,,")
+        for element in ('TMAX', 'TMIN', 'PRCP'):
+            inventory.append(f"{station_id} {latitudes[i]:8.4f} {longitudes[i]:9.4f} {element} "
+                             f"{first_years[i]} {last_years[i]}")
+    return ("\n".join(stations) + "\n").encode(), ("\n".join(inventory) + "\n").encode()
+
+
+@lru_cache(maxsize=256)
+def synthetic_dly(station_id, first_year, last_year):
+    """
+    Creates a '.dly' file with TMAX and TMIN for every day between first_year and last_year.
+
+    Returns:
+        bytes: The content of the file
+    """
+    rng = _station_rng(station_id)
+    lines = []
+    for year in range(first_year, last_year + 1):
+        for month in range(1, 13):
+            season = 100 * np.sin((month - 4) / 12 * 2 * np.pi)
+            for element, base in (('TMAX', 150), ('TMIN', 50)):
+                values = (base + season + rng.normal(0, 30, 31) + (year - first_year) * 0.2).astype(int)
+                flags = np.where(rng.random(31) < 0.01, 'O', ' ')
+                days = "".join(f"{value:5d}{flag} S" for value, flag in zip(values, flags))
+                lines.append(f"{station_id}{year:04d}{month:02d}{element}{days}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def serve_noaa(port, n_stations, latency, jitter, seed):
+    """
+    Serves the synthetic catalog and station files like the NOAA server
+    ('ghcnd-stations.csv', 'ghcnd-inventory.txt' and 'all/<station>.dly').
+    """
+    stations_file, inventory_file = synthetic_catalog(n_stations, seed)
+    spans = {}
+    for line in inventory_file.decode().splitlines():
+        station_id, _, _, _, first_year, last_year = line.split()
+        spans[station_id] = (int(first_year), int(last_year))
+    last_modified = formatdate(time.time(), usegmt=True)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _content(self):
+            path = self.path.lstrip('/')
+            if path == 'ghcnd-stations.csv':
+                return stations_file
+            if path == 'ghcnd-inventory.txt':
+                return inventory_file
+            if path.startswith('all/') and path.endswith('.dly') and path[4:-4] in spans:
+                return synthetic_dly(path[4:-4], *spans[path[4:-4]])
+            return None
+
+        def _respond(self, send_body):
+            # Injected latency of the "remote" server
+            time.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+            content = self._content()
+            if content is None:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            compressed = 'gzip' in self.headers.get('Accept-Encoding', '')
+            if compressed:
+                content = gzip.compress(content, compresslevel=1)
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(content)))
+            self.send_header('Last-Modified', last_modified)
+            if compressed:
+                self.send_header('Content-Encoding', 'gzip')
+            self.end_headers()
+            if send_body:
+                self.wfile.write(content)
+
+        def do_GET(self):
+            self._respond(True)
+
+        def do_HEAD(self):
+            self._respond(False)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('', port), Handler)
+    print(f"Serving {n_stations} synthetic stations on http://localhost:{port}/ "
+          f"with {latency * 1000:.0f}±{jitter * 1000:.0f} ms latency")
+    server.serve_forever()
+
+
+def _outputs(output):
+    """
+    Splits the output string of a callback ('..a.b...c.d..' or 'a.b') into output specs.
+    """
+    if output.startswith('..'):
+        parts = output[2:-2].split('...')
+    else:
+        parts = [output]
+    outputs = [{'id': part.rsplit('.', 1)[0], 'property': part.rsplit('.', 1)[1]} for part in parts]
+    return outputs if len(outputs) > 1 else outputs[0]
+
+
+def _initial_values(layout, values=None):
+    """
+    Collects the initial properties of all components with an ID, as 'id.property' -> value.
+    """
+    values = {} if values is None else values
+    if isinstance(layout, list):
+        for child in layout:
+            _initial_values(child, values)
+    elif isinstance(layout, dict) and 'props' in layout:
+        props = layout['props']
+        if isinstance(props.get('id'), str):
+            for name, value in props.items():
+                if name not in ('id', 'children'):
+                    values[f"{props['id']}.{name}"] = value
+        _initial_values(props.get('children'), values)
+    return values
+
+
+class AppClient:
+    """
+    One simulated user: keeps the current property values like the browser
+    and sends the callback requests of the app.
+    """
+
+    def __init__(self, url, dependencies, layout_values, timings, timings_lock):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        self.callbacks = {dependency['output']: dependency for dependency in dependencies}
+        self.values = dict(layout_values)
+        self.timings = timings
+        self.timings_lock = timings_lock
+
+    def call(self, output, changed):
+        """
+        Sends one callback request and stores the returned properties.
+
+        Args:
+            output (str): Output string of the callback, see CALLBACK_NAMES
+            changed (list): 'id.property' of the inputs that triggered the callback
+
+        Returns:
+            dict: The response of the callback, empty if there is no update
+        """
+        dependency = self.callbacks[output]
+        body = {
+            'output': output,
+            'outputs': _outputs(output),
+            'inputs': [{**item, 'value': self.values.get(f"{item['id']}.{item['property']}")}
+                       for item in dependency['inputs']],
+            'state': [{**item, 'value': self.values.get(f"{item['id']}.{item['property']}")}
+                      for item in dependency['state']],
+            'changedPropIds': changed
+        }
+
+        start = time.perf_counter()
+        try:
+            r = self.session.post(f"{self.url}/_dash-update-component", json=body, timeout=300)
+            ok = r.status_code in (200, 204)
+        except requests.exceptions.RequestException:
+            r, ok = None, False
+        duration = time.perf_counter() - start
+
+        with self.timings_lock:
+            self.timings.setdefault(CALLBACK_NAMES.get(output, output), []).append((duration, ok))
+
+        if not ok or r.status_code == 204:
+            return {}
+        response = r.json().get('response', {})
+        for component_id, props in response.items():
+            for name, value in props.items():
+                self.values[f"{component_id}.{name}"] = value
+                # Components rendered by the callback (e.g. the station table) bring their own properties
+                _initial_values(value, self.values)
+        return response
+
+    def station_click(self, row):
+        self.values['stations-table.selected_rows'] = [row]
+        self.call('yearly-data-container.children', ['stations-table.selected_rows'])
+        # The browser then renders the trend panel and the detail graph
+        if self.values.get('drilldown-station.data'):
+            self.call('trend-container.children', ['drilldown-station.data'])
+            self.values['drilldown-width.data'] = 1200
+            self.call('drilldown-graph.figure', ['drilldown-width.data'])
+
+    def search(self):
+        self.values['latitude-input.value'] = random.uniform(*LAT_RANGE)
+        self.values['longitude-input.value'] = random.uniform(*LON_RANGE)
+        self.values['search-stations-button.n_clicks'] = (self.values.get('search-stations-button.n_clicks') or 0) + 1
+        self.call('selected-stations-store.data', ['search-stations-button.n_clicks'])
+        self.call('station-data-table.children', ['selected-stations-store.data'])
+        return len(self.values.get('selected-stations-store.data') or [])
+
+    def session_run(self):
+        """
+        One visit: search, click a station, change the period and click a station again.
+        """
+        n_stations = self.search()
+        if n_stations == 0:
+            return
+        self.station_click(random.randrange(n_stations))
+
+        # Change the period, the search and the table are updated by the app
+        self.values['year-from.value'] = random.randint(1950, 2010)
+        self.call('..year-to.value...year-from.value..', ['year-from.value'])
+        self.call('selected-stations-store.data', ['year-from.value'])
+        self.call('station-data-table.children', ['selected-stations-store.data'])
+        n_stations = len(self.values.get('selected-stations-store.data') or [])
+        if n_stations:
+            self.station_click(random.randrange(n_stations))
+
+
+def print_report(timings, elapsed):
+    """
+    Prints the number of requests, throughput and latency percentiles per callback.
+    """
+    print(f"\n{'Callback':<16}{'Requests':>10}{'Errors':>8}{'Req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    print("=" * 73)
+    everything = []
+    for name, results in sorted(timings.items()):
+        durations = np.array([duration for duration, ok in results]) * 1000
+        errors = sum(not ok for duration, ok in results)
+        everything.extend(results)
+        p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+        print(f"{name:<16}{len(results):>10}{errors:>8}{len(results) / elapsed:>9.1f}{p50:>10.0f}{p95:>10.0f}{p99:>10.0f}")
+    if everything:
+        durations = np.array([duration for duration, ok in everything]) * 1000
+        p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+        errors = sum(not ok for duration, ok in everything)
+        print("-" * 73)
+        print(f"{'total':<16}{len(everything):>10}{errors:>8}{len(everything) / elapsed:>9.1f}"
+              f"{p50:>10.0f}{p95:>10.0f}{p99:>10.0f}")
+    print(f"\n{elapsed:.1f} s")
+
+
+def run_load_test(url, users, sessions, think_time, seed):
+    """
+    Runs the simulated users against the app and prints the report.
+    """
+    random.seed(seed)
+    dependencies = requests.get(f"{url}/_dash-dependencies", timeout=60).json()
+    layout_values = _initial_values(requests.get(f"{url}/_dash-layout", timeout=60).json())
+    timings, timings_lock = {}, threading.Lock()
+
+    def user(user_id):
+        client = AppClient(url, dependencies, layout_values, timings, timings_lock)
+        for _ in range(sessions):
+            client.session_run()
+            time.sleep(think_time)
+
+    print(f"Running {users} users with {sessions} sessions each against {url}")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        list(executor.map(user, range(users)))
+    print_report(timings, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the weather station app")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve-noaa', help="serve synthetic NOAA files with latency")
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--stations', type=int, default=2000, help="number of synthetic stations")
+    serve.add_argument('--latency', type=float, default=0.2, help="delay of every response in seconds")
+    serve.add_argument('--jitter', type=float, default=0.05, help="random part of the delay in seconds")
+    serve.add_argument('--seed', type=int, default=0)
+
+    run = commands.add_parser('run', help="replay user sessions against the app")
+    run.add_argument('--url', default="http://localhost:8050")
+    run.add_argument('--users', type=int, default=10, help="number of concurrent users")
+    run.add_argument('--sessions', type=int, default=3, help="sessions per user")
+    run.add_argument('--think-time', type=float, default=0.0, help="pause between sessions in seconds")
+    run.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+    if args.command == 'serve-noaa':
+        serve_noaa(args.port, args.stations, args.latency, args.jitter, args.seed)
+    else:
+        run_load_test(args.url.rstrip('/'), args.users, args.sessions, args.think_time, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,45 +1,92 @@
 import pandas as pd
 import dash
 from dash import html, dcc, Input, Output, State, ctx
-import plotly.express as px
 import json
 import numpy as np
-from math import radians, sin, cos, sqrt, atan2
+import math
 import os
 
-# Import the custom functions from data_loader and clean_data
-from data_loader import download_station_data
-from clean_data import clean_station_data, create_monthly_averages, create_yearly_averages
+# Import the custom functions for the station data
+from station_store import ensure_station_data, ensure_stations_data, load_time_series
+from downsample import downsample_series
+from station_stats import (load_seasonal_sums, seasonal_table, period_summary, regional_means, station_trends,
+                           BASELINE_FROM, BASELINE_TO)
+from api import register_export_route, register_map_route, register_nearest_route
+from map_payload import MAP_PAYLOAD_URL, build_map_payload
+from station_search import StationSearchIndex
+from nearest_stations import haversine_distance
+from refresher import start_refresher
+from year_coverage import COVERAGE_FILE, load_coverage, covered_years
+from profiling import profiled
 
 # Create the Dash app
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 
-stations_df = pd.read_csv('./data/stations.csv',
-                          usecols=['Station_Name', 'Latitude', 'Longitude', 'FirstYear', 'LastYear', 'Station_ID'])
-
-# Create the map figure using scatter_mapbox
-fig = px.scatter_mapbox(stations_df,
-                         lat='Latitude',
-                         lon='Longitude',
-                         hover_name='Station_Name',
-                         height=600)
-
-# Set consistent styling
-fig.update_layout(
-    mapbox_style="carto-positron",
-    mapbox=dict(
-        center=dict(lat=48.0458, lon=8.4617),
-        zoom=4,
-    ),
-    margin={"r":0,"t":0,"l":0,"b":0},
-    clickmode='event+select'
-)
+# Add the export endpoint to the Flask server of the app
+register_export_route(app.server)
 
-# Set consistent marker size for all points
-fig.update_traces(
-    marker=dict(size=5),  
-    selector=dict(type='scattermapbox')  
-)
+def load_stations():
+    return pd.read_csv('./data/stations.csv',
+                       usecols=['Station_Name', 'Latitude', 'Longitude', 'FirstYear', 'LastYear', 'Station_ID'])
+
+
+def reload_stations():
+    # Called by the refresher after it replaced stations.csv
+    global stations_df, map_payload, station_index
+    stations_df = load_stations()
+    map_payload = build_map_payload(stations_df)
+    station_index = StationSearchIndex(stations_df)
+
+
+stations_df = load_stations()
+
+# Station layer of the map, compressed once and served by /station-map-payload
+map_payload = build_map_payload(stations_df)
+register_map_route(app.server, lambda: map_payload)
+
+# Index for the station search by name and ID
+station_index = StationSearchIndex(stations_df)
+
+# Year coverage bitsets of all stations, in the order of stations_df:
+# (stations_df, modification time of the file, bits, measured)
+station_coverage = {'entry': None}
+
+
+def get_station_coverage(stations):
+    # Loaded again when the file changes (catalog rebuilt, station downloaded) or when the
+    # catalog was reloaded, which can have the same length but a different order
+    mtime = os.path.getmtime(COVERAGE_FILE) if os.path.exists(COVERAGE_FILE) else None
+    entry = station_coverage['entry']
+    if entry is None or entry[0] is not stations or entry[1] != mtime:
+        entry = (stations, mtime, *load_coverage(stations))
+        station_coverage['entry'] = entry
+    return entry[2], entry[3]
+
+
+def get_catalog():
+    # The catalog and its coverage, read once so a refresh can't mix two catalogs
+    stations = stations_df
+    return (stations, *get_station_coverage(stations))
+
+
+# Batch lookup of the nearest stations for many coordinates
+register_nearest_route(app.server, get_catalog)
+
+# The map starts without stations, the clientside callback below adds them
+# from the station map payload
+map_figure = {
+    'data': [],
+    'layout': {
+        'height': 600,
+        'mapbox': {
+            'style': 'carto-positron',
+            'center': {'lat': 48.0458, 'lon': 8.4617},
+            'zoom': 4
+        },
+        'margin': {"r": 0, "t": 0, "l": 0, "b": 0},
+        'clickmode': 'event+select'
+    }
+}
 
 # Define the app layout
 app.layout = html.Div([
@@ -60,18 +107,33 @@ app.layout = html.Div([
                 # Map container (left side)
                 html.Div([
                     dcc.Graph(id='station-map', 
-                              figure=fig,
+                              figure=map_figure,
                               config={
                                   'scrollZoom': True,
                                   'displayModeBar': False
                               }),
-                    dcc.Store(id='clicked-coord', data={'lat': None, 'lon': None})
+                    dcc.Store(id='clicked-coord', data={'lat': None, 'lon': None}),
+                    dcc.Store(id='map-payload-url', data=MAP_PAYLOAD_URL),
+                    # Center of the map after a station was picked in the search
+                    dcc.Store(id='map-center')
                 ], style={'width': '75%', 'display': 'inline-block'}),
                 
                 # Sidebar container (right side)
                 html.Div([
                     html.H3('Sucheinstellungen', style={'marginBottom': '20px'}),
                     
+                    # Station search by name or ID
+                    html.Label('Station suchen', style={'fontWeight': 'bold'}),
+                    dcc.Dropdown(
+                        id='station-search',
+                        placeholder='Name oder Stations-ID eingeben',
+                        options=[],
+                        searchable=True,
+                        clearable=True,
+                        style={'marginTop': '5px', 'marginBottom': '10px'}
+                    ),
+                    html.Br(),
+                    
                     # Radius input
                     html.Label('Suchradius (max. 100km)', style={'fontWeight': 'bold'}),
                     dcc.Input(
@@ -145,7 +207,27 @@ app.layout = html.Div([
                             })
                         ], style={'width': '48%', 'display': 'inline-block', 'marginLeft': '4%'})
                     ]),
-                    html.Br(),                    
+                    html.Br(),
+                    
+                    # Minimum share of the period with data
+                    html.Label('Mindestabdeckung des Zeitraums (%)', style={'fontWeight': 'bold'}),
+                    dcc.Input(
+                        id='coverage-input',
+                        type='number',
+                        min=0,
+                        max=100,
+                        value=0,
+                        step=5,
+                        style={
+                            'width': '100%',
+                            'padding': '8px',
+                            'marginTop': '5px',
+                            'marginBottom': '10px',
+                            'borderRadius': '4px',
+                            'border': '1px solid #ccc'
+                        }
+                    ),
+                    html.Br(),
                     
                     # Coordinate inputs
                     html.Label('Koordinaten eingeben', style={'fontWeight': 'bold'}),
@@ -231,8 +313,60 @@ app.layout = html.Div([
             html.Div([
                 # Container for the station data table
                 html.Div(id='station-data-table'),
+                # Quality control policy for the averages
+                html.Div([
+                    html.Label('Qualitätskontrolle', style={'fontWeight': 'bold'}),
+                    dcc.RadioItems(
+                        id='qc-policy',
+                        options=[
+                            {'label': 'Alle Werte', 'value': 'none'},
+                            {'label': 'Ohne Ausreißer', 'value': 'outliers'},
+                            {'label': 'Nur Werte ohne Qualitäts-Flag', 'value': 'strict'}
+                        ],
+                        value='none',
+                        inline=True,
+                        inputStyle={'marginRight': '5px', 'marginLeft': '10px'}
+                    ),
+                    # Baseline period of the anomalies
+                    html.Label('Referenzzeitraum', style={'fontWeight': 'bold', 'marginLeft': '30px',
+                                                          'marginRight': '10px'}),
+                    dcc.Input(id='baseline-from', type='number', min=0, max=2024, value=BASELINE_FROM, step=1,
+                              debounce=True, style={'width': '80px', 'padding': '5px'}),
+                    html.Span(' - '),
+                    dcc.Input(id='baseline-to', type='number', min=0, max=2024, value=BASELINE_TO, step=1,
+                              debounce=True, style={'width': '80px', 'padding': '5px'})
+                ], style={'marginTop': '20px'}),
                 # Container for the yearly data
-                html.Div(id='yearly-data-container')
+                html.Div(id='yearly-data-container'),
+                # Mean of all stations of the search
+                html.Div([
+                    html.H3('Regionales Mittel', style={'marginBottom': '10px'}),
+                    dcc.RadioItems(
+                        id='regional-weighting',
+                        options=[
+                            {'label': 'Nach Entfernung gewichtet', 'value': 'distance'},
+                            {'label': 'Einfaches Mittel', 'value': 'equal'}
+                        ],
+                        value='distance',
+                        inline=True,
+                        inputStyle={'marginRight': '5px', 'marginLeft': '10px'}
+                    ),
+                    html.Label('Mindestanteil der Stationen pro Jahr (%)',
+                               style={'fontWeight': 'bold', 'marginRight': '10px'}),
+                    dcc.Input(id='regional-min-share', type='number', min=0, max=100, value=50, step=10,
+                              style={'width': '80px', 'padding': '5px', 'marginTop': '10px'}),
+                    html.Button('Regionales Mittel berechnen',
+                                id='regional-button',
+                                style={
+                                    'marginLeft': '20px',
+                                    'padding': '8px',
+                                    'backgroundColor': '#4CAF50',
+                                    'color': 'white',
+                                    'border': 'none',
+                                    'cursor': 'pointer'
+                                }),
+                    html.Div(id='regional-data-container')
+                ], style={'marginTop': '40px', 'marginBottom': '40px'})
             ])
         ])            
     ])
@@ -240,16 +374,47 @@ app.layout = html.Div([
 
 
 
-def haversine_distance(lat1, lon1, lat2, lon2):
-    R = 6371  # Earth's radius in kilometers
-    
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    return R * c
+# Loads the station layer into the map. The browser caches the payload and
+# only checks its ETag on repeat visits.
+app.clientside_callback(
+    """
+    function(url, figure) {
+        return fetch(url).then(function(response) {
+            return response.arrayBuffer();
+        }).then(function(buffer) {
+            // Layout of the payload: see map_payload.py
+            var count = new DataView(buffer).getUint32(0, true);
+            var latitudeSteps = new Int32Array(buffer, 4, count);
+            var longitudes = new Int32Array(buffer, 4 + 4 * count, count);
+            var names = new TextDecoder('utf-8').decode(new Uint8Array(buffer, 4 + 8 * count)).split('\\n');
+
+            var lat = new Array(count);
+            var lon = new Array(count);
+            var latitude = 0;
+            for (var i = 0; i < count; i++) {
+                latitude += latitudeSteps[i];
+                lat[i] = latitude / 10000;
+                lon[i] = longitudes[i] / 10000;
+            }
+            return {
+                'data': [{
+                    'type': 'scattermapbox',
+                    'lat': lat,
+                    'lon': lon,
+                    'hovertext': names,
+                    'hovertemplate': '<b>%{hovertext}</b><br><br>Latitude=%{lat}<br>Longitude=%{lon}<extra></extra>',
+                    'mode': 'markers',
+                    'marker': {'size': 5}
+                }],
+                'layout': figure.layout
+            };
+        });
+    }
+    """,
+    Output('station-map', 'figure'),
+    Input('map-payload-url', 'data'),
+    State('station-map', 'figure')
+)
 
 
 @app.callback(
@@ -268,48 +433,93 @@ def update_click_info(clickData):
     return f'Selected coordinates: {lat:.4f}, {lon:.4f}', lat, lon
 
 @app.callback(
-    Output('station-map', 'figure'),
+    Output('station-search', 'options'),
+    Input('station-search', 'search_value'),
+    State('station-search', 'value'),
+    State('station-search', 'options'),
+    prevent_initial_call=True
+)
+def update_search_options(search_value, value, options):
+    if not search_value:
+        return dash.no_update
+    
+    # 'search' is set to the typed text, otherwise the dropdown would hide the trigram matches
+    results = [{'label': f"{station['Station_Name']} ({station['Station_ID']})",
+                'value': station['Station_ID'],
+                'search': search_value}
+               for station in station_index.search(search_value)]
+    
+    # Keep the selected station, so its label doesn't disappear
+    selected = [option for option in options or [] if option['value'] == value]
+    if selected and all(result['value'] != value for result in results):
+        results = selected + results
+    return results
+
+@app.callback(
+    Output('latitude-input', 'value', allow_duplicate=True),
+    Output('longitude-input', 'value', allow_duplicate=True),
+    Output('map-center', 'data'),
+    Input('station-search', 'value'),
+    prevent_initial_call=True
+)
+def select_search_result(station_id):
+    station = station_index.find(station_id) if station_id else None
+    if station is None:
+        return dash.no_update, dash.no_update, dash.no_update
+    
+    # The new coordinates start the station search around the selected station
+    return station['Latitude'], station['Longitude'], {'lat': station['Latitude'], 'lon': station['Longitude']}
+
+# Moves the map to the selected station
+app.clientside_callback(
+    """
+    function(center, figure) {
+        var layout = Object.assign({}, figure.layout);
+        layout.mapbox = Object.assign({}, layout.mapbox, {'center': center, 'zoom': 8});
+        return Object.assign({}, figure, {'layout': layout});
+    }
+    """,
+    Output('station-map', 'figure', allow_duplicate=True),
+    Input('map-center', 'data'),
+    State('station-map', 'figure'),
+    prevent_initial_call=True
+)
+
+@app.callback(
     Output('selected-stations-store', 'data'),
     Input('search-stations-button', 'n_clicks'),
     Input('radius-slider', 'value'),
     Input('station-count-slider', 'value'),
     Input('year-from', 'value'),
     Input('year-to', 'value'),
+    Input('coverage-input', 'value'),
+    Input('map-center', 'data'),
     State('latitude-input', 'value'),
     State('longitude-input', 'value'),
-    State('station-map', 'figure'),
     prevent_initial_call=False
 )
-def update_stations_selection(n_clicks, radius_value, count_value, year_from, year_to, lat, lon, figure):
-    # Handle the initial call
-    if n_clicks is None:
-        # Calculate initial stations based on default coordinates
-        stations_df['Distance'] = stations_df.apply(
-            lambda row: haversine_distance(lat, lon, row['Latitude'], row['Longitude']), 
-            axis=1
-        )
-        
-        filtered_stations = stations_df[
-            (stations_df['FirstYear'] <= year_to) & 
-            (stations_df['LastYear'] >= year_from) &
-            (stations_df['Distance'] <= radius_value)
-        ].nsmallest(count_value, 'Distance')
-        
-        return figure, filtered_stations.to_dict('records')
+@profiled()
+def update_stations_selection(n_clicks, radius_value, count_value, year_from, year_to, min_coverage, map_center, lat, lon):
+    stations = stations_df
     
-    # Rest of the function remains the same
-    stations_df['Distance'] = stations_df.apply(
-        lambda row: haversine_distance(lat, lon, row['Latitude'], row['Longitude']), 
-        axis=1
-    )
+    # Distances to all stations at once
+    distances = haversine_distance(lat, lon, stations['Latitude'].values, stations['Longitude'].values)
+    
+    # Years of the period with data, counted with the coverage bitsets of all stations
+    bits, measured = get_station_coverage(stations)
+    covered, n_years = covered_years(bits, year_from, year_to)
+    required_years = max(1, math.ceil((min_coverage or 0) / 100 * n_years))
     
-    filtered_stations = stations_df[
-        (stations_df['FirstYear'] <= year_to) & 
-        (stations_df['LastYear'] >= year_from) &
-        (stations_df['Distance'] <= radius_value)
-    ].nsmallest(count_value, 'Distance')
+    candidates = np.flatnonzero((covered >= required_years) & (distances <= radius_value))
+    nearest = candidates[np.argsort(distances[candidates], kind='stable')[:count_value]]
     
-    return figure, filtered_stations.to_dict('records')
+    filtered_stations = stations.iloc[nearest].assign(
+        Distance=distances[nearest],
+        Coverage=np.round(100 * covered[nearest] / max(n_years, 1), 1),
+        Coverage_Measured=measured[nearest]
+    )
+    
+    return filtered_stations.to_dict('records')
 
 @app.callback(
     Output('station-data-table', 'children'),
@@ -322,12 +532,17 @@ def update_station_table(selected_stations):
     
     # Convert stored data directly to DataFrame
     display_df = pd.DataFrame(selected_stations)[
-        ['Station_Name', 'Distance', 'FirstYear', 'LastYear', 'Station_ID', 'Latitude']  # Added Latitude
+        ['Station_Name', 'Distance', 'FirstYear', 'LastYear', 'Coverage', 'Station_ID', 'Latitude']  # Added Latitude
     ]
     
     # Round Distance to 2 decimal places
     display_df['Distance'] = display_df['Distance'].round(2)
     
+    # Coverage only estimated from the inventory (first to last year) is marked
+    measured = pd.DataFrame(selected_stations)['Coverage_Measured']
+    display_df['Coverage'] = [coverage if is_measured else f"≈ {coverage} (geschätzt)"
+                              for coverage, is_measured in zip(display_df['Coverage'], measured)]
+    
     return dash.dash_table.DataTable(
         id='stations-table',  # Added the ID here
         data=display_df.to_dict('records'),
@@ -336,6 +551,7 @@ def update_station_table(selected_stations):
             {'name': 'Distance (km)', 'id': 'Distance'},
             {'name': 'First Year', 'id': 'FirstYear'},
             {'name': 'Last Year', 'id': 'LastYear'},
+            {'name': 'Abdeckung (%)', 'id': 'Coverage'},
             {'name': 'Station ID', 'id': 'Station_ID'}
         ],
         style_table={'overflowX': 'auto'},
@@ -381,12 +597,14 @@ def validate_years(year_from, year_to):
 @app.callback(
     Output('yearly-data-container', 'children'),
     Input('stations-table', 'selected_rows'),
+    Input('qc-policy', 'value'),
     State('stations-table', 'data'),
     State('year-from', 'value'),  # Add year range inputs
     State('year-to', 'value'),
     prevent_initial_call=True
 )
-def display_yearly_data(selected_rows, table_data, year_from, year_to):
+@profiled(station_id=lambda args: args['table_data'][args['selected_rows'][0]]['Station_ID'])
+def display_yearly_data(selected_rows, qc_policy, table_data, year_from, year_to):
     if not selected_rows:
         return ""
     
@@ -395,109 +613,37 @@ def display_yearly_data(selected_rows, table_data, year_from, year_to):
     station_id = selected_station['Station_ID']
     station_lat = selected_station['Latitude']
     
-    # Check if files exist and create if needed
-    monthly_file = f"./data/stations/{station_id}_monthly.csv"
-    yearly_file = f"./data/stations/{station_id}_yearly.csv"
-    raw_file = f"./data/stations/{station_id}.csv"
-    
-    # Check if we need to download new station data
-    if not (os.path.exists(monthly_file) and os.path.exists(yearly_file)):
-        # Check number of existing stations and remove oldest if necessary
-        station_files = [f for f in os.listdir("./data/stations") if f.endswith('_yearly.csv')]
-        if len(station_files) >= 10:
-            # Get creation times for all station files
-            station_times = []
-            for fname in station_files:
-                station_id_from_file = fname.replace('_yearly.csv', '')
-                files_to_check = [
-                    f"./data/stations/{station_id_from_file}.csv",
-                    f"./data/stations/{station_id_from_file}_monthly.csv",
-                    f"./data/stations/{station_id_from_file}_yearly.csv"
-                ]
-                # Use the oldest file's creation time for each station
-                creation_time = min(os.path.getctime(f) for f in files_to_check if os.path.exists(f))
-                station_times.append((station_id_from_file, creation_time))
-            
-            # Get the oldest station ID
-            oldest_station = min(station_times, key=lambda x: x[1])[0]
-            
-            # Remove the oldest station's files
-            for ext in ['', '_monthly', '_yearly']:
-                old_file = f"./data/stations/{oldest_station}{ext}.csv"
-                if os.path.exists(old_file):
-                    os.remove(old_file)
-        
-        # Now download and process the new station data
-        if download_station_data(station_id):
-            if clean_station_data(station_id):
-                if create_monthly_averages(station_id):
-                    create_yearly_averages(station_id)
+    # Download and process the station data if needed
+    ensure_station_data(station_id, qc_policy)
     
     try:
-        yearly_df = pd.read_csv(yearly_file)
-        monthly_df = pd.read_csv(monthly_file)
-        
-        # Filter data based on selected year range
-        monthly_df = monthly_df[
-            (monthly_df['Year'] >= year_from) & 
-            (monthly_df['Year'] <= year_to)
-        ]
+        seasonal_df = load_seasonal_sums(station_id, qc_policy)
         
         is_northern = station_lat >= 0
         
-        def calculate_seasonal_data(df):
-            seasonal_data = []
-            
-            for year in df['Year'].unique():
-                current_year = df[df['Year'] == year]
-                prev_year = df[df['Year'] == year - 1]
-                
-                if is_northern:
-                    winter_months = pd.concat([
-                        prev_year[prev_year['Month'] == 12] if not prev_year.empty else pd.DataFrame(),
-                        current_year[current_year['Month'].isin([1, 2])]
-                    ])
-                    spring_months = current_year[current_year['Month'].isin([3, 4, 5])]
-                    summer_months = current_year[current_year['Month'].isin([6, 7, 8])]
-                    fall_months = current_year[current_year['Month'].isin([9, 10, 11])]
-                else:
-                    summer_months = pd.concat([
-                        prev_year[prev_year['Month'] == 12] if not prev_year.empty else pd.DataFrame(),
-                        current_year[current_year['Month'].isin([1, 2])]
-                    ])
-                    fall_months = current_year[current_year['Month'].isin([3, 4, 5])]
-                    winter_months = current_year[current_year['Month'].isin([6, 7, 8])]
-                    spring_months = current_year[current_year['Month'].isin([9, 10, 11])]
-                
-                row_data = {
-                    'Jahr': year,
-                    'Min. (jährlich)': yearly_df[yearly_df['Year'] == year]['TMIN'].iloc[0],
-                    'Max. (jährlich)': yearly_df[yearly_df['Year'] == year]['TMAX'].iloc[0],
-                    'Winter_Min': winter_months['TMIN'].mean().round(2) if not winter_months.empty else None,
-                    'Winter_Max': winter_months['TMAX'].mean().round(2) if not winter_months.empty else None,
-                    'Frühling_Min': spring_months['TMIN'].mean().round(2) if not spring_months.empty else None,
-                    'Frühling_Max': spring_months['TMAX'].mean().round(2) if not spring_months.empty else None,
-                    'Sommer_Min': summer_months['TMIN'].mean().round(2) if not summer_months.empty else None,
-                    'Sommer_Max': summer_months['TMAX'].mean().round(2) if not summer_months.empty else None,
-                    'Herbst_Min': fall_months['TMIN'].mean().round(2) if not fall_months.empty else None,
-                    'Herbst_Max': fall_months['TMAX'].mean().round(2) if not fall_months.empty else None,
-                }
-                seasonal_data.append(row_data)
-            
-            return pd.DataFrame(seasonal_data)
-        
-        combined_df = calculate_seasonal_data(monthly_df)
-        
-        # Filter combined data for selected year range
-        combined_df = combined_df[
-            (combined_df['Jahr'] >= year_from) & 
-            (combined_df['Jahr'] <= year_to)
-        ]
+        # Yearly and seasonal values as well as the summary rows come from the
+        # precomputed prefix sums, so no means are recalculated here
+        combined_df = seasonal_table(seasonal_df, year_from, year_to, is_northern)
+        summary_df = period_summary(seasonal_df, year_from, year_to, is_northern)
         
         return [
             html.H3(f"{selected_station['Station_Name']}",
                    style={'marginTop': '20px', 'marginBottom': '10px'}),
             
+            # Download links for the station data of the selected period
+            html.Div(
+                [html.Span('Export (CSV): ', style={'fontWeight': 'bold'})] +
+                [
+                    html.A(label,
+                           href=f"/export?stations={station_id}&kind={kind}&from={year_from}&to={year_to}"
+                                f"&format=csv&qc={qc_policy}",
+                           style={'marginRight': '15px'})
+                    for kind, label in [('raw', 'Tageswerte'), ('monthly', 'Monatlich'),
+                                        ('yearly', 'Jährlich'), ('seasonal', 'Jahreszeiten')]
+                ],
+                style={'marginBottom': '10px'}
+            ),
+            
             # Data Table
             dash.dash_table.DataTable(
                 data=combined_df.to_dict('records'),
@@ -600,7 +746,50 @@ def display_yearly_data(selected_rows, table_data, year_from, year_to):
                 ],
                 sort_action='native'
             ),
-            
+
+            # Summary of the selected period below the table
+            html.H4('Zusammenfassung des Zeitraums',
+                    style={'marginTop': '20px', 'marginBottom': '10px'}),
+            dash.dash_table.DataTable(
+                data=summary_df.to_dict('records'),
+                columns=[
+                    {'name': 'Zeitraum', 'id': 'Jahr'},
+                    {'name': 'Min. (jährlich)', 'id': 'Min. (jährlich)'},
+                    {'name': 'Max. (jährlich)', 'id': 'Max. (jährlich)'},
+                    {'name': 'Winter Min.', 'id': 'Winter_Min'},
+                    {'name': 'Winter Max.', 'id': 'Winter_Max'},
+                    {'name': 'Frühling Min.', 'id': 'Frühling_Min'},
+                    {'name': 'Frühling Max.', 'id': 'Frühling_Max'},
+                    {'name': 'Sommer Min.', 'id': 'Sommer_Min'},
+                    {'name': 'Sommer Max.', 'id': 'Sommer_Max'},
+                    {'name': 'Herbst Min.', 'id': 'Herbst_Min'},
+                    {'name': 'Herbst Max.', 'id': 'Herbst_Max'}
+                ],
+                style_table={'overflowX': 'auto'},
+                style_cell={
+                    'textAlign': 'center',
+                    'padding': '10px',
+                    'minWidth': '80px',
+                    'height': '30px'
+                },
+                style_header={
+                    'backgroundColor': 'rgb(230, 230, 230)',
+                    'fontWeight': 'bold',
+                    'textAlign': 'center',
+                    'height': '40px'
+                },
+                style_data_conditional=[
+                    {
+                        'if': {'column_id': 'Jahr'},
+                        'fontWeight': 'bold',
+                        'textAlign': 'left'
+                    }
+                ]
+            ),
+
+            # Trend and anomalies, filled by display_trends()
+            html.Div(id='trend-container'),
+
             # Temperature Graph below the table
             html.Div([
                 dcc.Graph(
@@ -665,11 +854,308 @@ def display_yearly_data(selected_rows, table_data, year_from, year_to):
             ], style={
                 'marginTop': '20px',
                 'marginBottom': '40px'
-            })
+            }),
+
+            # Drill-down graph with the daily or monthly values
+            html.H4('Detailansicht', style={'marginBottom': '10px'}),
+            dcc.RadioItems(
+                id='drilldown-resolution',
+                options=[
+                    {'label': 'Monatlich', 'value': 'monthly'},
+                    {'label': 'Täglich', 'value': 'daily'}
+                ],
+                value='monthly',
+                inline=True,
+                inputStyle={'marginRight': '5px', 'marginLeft': '10px'}
+            ),
+            # Selected station for the trend panel and the drill-down graph
+            dcc.Store(id='drilldown-station', data={
+                'station_id': station_id,
+                'year_from': year_from,
+                'year_to': year_to,
+                'qc_policy': qc_policy,
+                'is_northern': is_northern
+            }),
+            dcc.Store(id='drilldown-width'),
+            dcc.Graph(
+                id='drilldown-graph',
+                config={'displayModeBar': False},
+                style={'height': '500px', 'marginBottom': '40px'}
+            )
+        ]
+    except Exception as e:
+        return html.Div(f"Error loading data: {str(e)}", style={'color': 'red'})
+
+
+# Column, name and color of the ten Min/Max series in the trend and regional tables and graphs
+SERIES_LINES = [
+    ('Min. (jährlich)', 'Min. (jährlich)', '#0000ff'),
+    ('Max. (jährlich)', 'Max. (jährlich)', '#ff0000'),
+    ('Winter_Min', 'Winter Min.', '#969696'),
+    ('Winter_Max', 'Winter Max.', '#626262'),
+    ('Frühling_Min', 'Frühling Min.', '#47D45A'),
+    ('Frühling_Max', 'Frühling Max.', '#3B7D23'),
+    ('Sommer_Min', 'Sommer Min.', '#E97132'),
+    ('Sommer_Max', 'Sommer Max.', '#CC5316'),
+    ('Herbst_Min', 'Herbst Min.', '#75300D'),
+    ('Herbst_Max', 'Herbst Max.', '#4C1F08')
+]
+
+
+@app.callback(
+    Output('trend-container', 'children'),
+    Input('drilldown-station', 'data'),
+    Input('baseline-from', 'value'),
+    Input('baseline-to', 'value'),
+    prevent_initial_call=True
+)
+@profiled(station_id=lambda args: args['station']['station_id'])
+def display_trends(station, baseline_from, baseline_to):
+    if not station:
+        return ""
+    if baseline_from is None or baseline_to is None or baseline_from > baseline_to:
+        return html.Div("Ungültiger Referenzzeitraum", style={'color': 'red', 'marginTop': '20px'})
+    
+    try:
+        # Cached per station, so this adds almost nothing to a row click
+        trend_df, anomaly_df = station_trends(station['station_id'], station['year_from'], station['year_to'],
+                                              station['is_northern'], baseline_from, baseline_to,
+                                              station['qc_policy'])
+    except Exception as e:
+        return html.Div(f"Error loading data: {str(e)}", style={'color': 'red'})
+    
+    return [
+        html.H4('Trend und Anomalien', style={'marginTop': '20px', 'marginBottom': '10px'}),
+        dash.dash_table.DataTable(
+            data=trend_df.to_dict('records'),
+            columns=[{'name': '', 'id': 'Jahr'}] + [{'name': name, 'id': column} for column, name, color in SERIES_LINES],
+            style_table={'overflowX': 'auto'},
+            style_cell={
+                'textAlign': 'center',
+                'padding': '10px',
+                'minWidth': '80px',
+                'height': '30px'
+            },
+            style_header={
+                'backgroundColor': 'rgb(230, 230, 230)',
+                'fontWeight': 'bold',
+                'textAlign': 'center',
+                'height': '40px'
+            },
+            style_data_conditional=[
+                {
+                    'if': {'column_id': 'Jahr'},
+                    'fontWeight': 'bold',
+                    'textAlign': 'left'
+                }
+            ]
+        ),
+        dcc.Graph(
+            id='anomaly-graph',
+            figure={
+                'data': [
+                    {'x': anomaly_df['Jahr'], 'y': anomaly_df[column],
+                     'name': name, 'line': {'color': color, 'width': 2}}
+                    for column, name, color in SERIES_LINES
+                ],
+                'layout': {
+                    'title': f"Abweichung vom Mittel {baseline_from}-{baseline_to}",
+                    'xaxis': {'title': 'Jahr', 'fixedrange': True},
+                    'yaxis': {'title': 'Abweichung in Grad C', 'fixedrange': True, 'zeroline': True},
+                    'hovermode': 'x unified',
+                    'legend': {'x': 1.05, 'y': 1, 'xanchor': 'left'},
+                    'height': 500
+                }
+            },
+            config={'displayModeBar': False},
+            style={'height': '500px'}
+        )
+    ]
+
+
+@app.callback(
+    Output('regional-data-container', 'children'),
+    Input('regional-button', 'n_clicks'),
+    Input('regional-weighting', 'value'),
+    Input('regional-min-share', 'value'),
+    Input('qc-policy', 'value'),
+    State('selected-stations-store', 'data'),
+    State('year-from', 'value'),
+    State('year-to', 'value'),
+    prevent_initial_call=True
+)
+@profiled()
+def display_regional_data(n_clicks, weighting, min_share, qc_policy, selected_stations, year_from, year_to):
+    # Only calculate after the button was clicked once
+    if not n_clicks:
+        return dash.no_update
+    if not selected_stations:
+        return "No stations selected"
+    
+    # Download the missing stations at the same time
+    available = ensure_stations_data([station['Station_ID'] for station in selected_stations], qc_policy)
+    stations = [station for station in selected_stations if station['Station_ID'] in available]
+    if not stations:
+        return html.Div("Keine Daten für die gefundenen Stationen", style={'color': 'red'})
+    
+    try:
+        regional_df = regional_means(stations, year_from, year_to, qc_policy, weighting,
+                                     (min_share or 0) / 100)
+        
+        return [
+            html.P(f"Mittel aus {len(stations)} von {len(selected_stations)} Stationen im Suchradius",
+                   style={'marginTop': '10px'}),
+            dash.dash_table.DataTable(
+                data=regional_df.to_dict('records'),
+                columns=[{'name': 'Jahr', 'id': 'Jahr'}] +
+                        [{'name': name, 'id': column} for column, name, color in SERIES_LINES] +
+                        [{'name': 'Stationen', 'id': 'Stationen'}],
+                style_table={
+                    'overflowX': 'auto',
+                    'overflowY': 'auto',
+                    'maxHeight': '400px'
+                },
+                style_cell={
+                    'textAlign': 'center',
+                    'padding': '10px',
+                    'minWidth': '80px',
+                    'height': '30px'
+                },
+                style_header={
+                    'backgroundColor': 'rgb(230, 230, 230)',
+                    'fontWeight': 'bold',
+                    'textAlign': 'center',
+                    'height': '40px'
+                },
+                style_data_conditional=[
+                    {'if': {'column_id': column}, 'color': color} for column, name, color in SERIES_LINES
+                ],
+                sort_action='native'
+            ),
+            dcc.Graph(
+                id='regional-graph',
+                figure={
+                    'data': [
+                        {'x': regional_df['Jahr'], 'y': regional_df[column],
+                         'name': name, 'line': {'color': color, 'width': 2}}
+                        for column, name, color in SERIES_LINES
+                    ],
+                    'layout': {
+                        'title': 'Temperaturverlauf der Region',
+                        'xaxis': {'title': 'Jahr', 'fixedrange': True},
+                        'yaxis': {'title': 'Temperatur in Grad C', 'fixedrange': True},
+                        'hovermode': 'x unified',
+                        'legend': {'x': 1.05, 'y': 1, 'xanchor': 'left'},
+                        'height': 600
+                    }
+                },
+                config={'displayModeBar': False},
+                style={'height': '600px', 'marginTop': '20px'}
+            )
         ]
     except Exception as e:
         return html.Div(f"Error loading data: {str(e)}", style={'color': 'red'})
 
+
+# Width of the drill-down graph in pixels, used to choose the number of points
+app.clientside_callback(
+    """
+    function(station) {
+        var graph = document.getElementById('drilldown-graph');
+        return graph && graph.offsetWidth ? graph.offsetWidth : window.innerWidth;
+    }
+    """,
+    Output('drilldown-width', 'data'),
+    Input('drilldown-station', 'data')
+)
+
+
+def relayout_x_range(relayout_data):
+    """
+    Returns the x range of a zoom event as datetime64 values,
+    None if the graph was reset or not zoomed.
+    """
+    if not relayout_data or relayout_data.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout_data:
+        start, end = relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    elif 'xaxis.range' in relayout_data:
+        start, end = relayout_data['xaxis.range']
+    else:
+        return None
+    return np.datetime64(pd.Timestamp(start)), np.datetime64(pd.Timestamp(end))
+
+
+@app.callback(
+    Output('drilldown-graph', 'figure'),
+    Input('drilldown-resolution', 'value'),
+    Input('drilldown-graph', 'relayoutData'),
+    Input('drilldown-width', 'data'),
+    State('drilldown-station', 'data'),
+    prevent_initial_call=True
+)
+@profiled(station_id=lambda args: args['station']['station_id'])
+def update_drilldown_graph(resolution, relayout_data, width, station):
+    if not station or not width:
+        return dash.no_update
+    
+    try:
+        # The station may have been removed from the cache since the graph was shown
+        if not ensure_station_data(station['station_id'], station['qc_policy']):
+            raise FileNotFoundError(f"No data for station {station['station_id']}")
+        series = load_time_series(station['station_id'], resolution, station['qc_policy'])
+    except Exception as e:
+        return {
+            'data': [],
+            'layout': {
+                'xaxis': {'visible': False},
+                'yaxis': {'visible': False},
+                'annotations': [{'text': f"Error loading data: {str(e)}", 'showarrow': False,
+                                 'font': {'color': 'red'}, 'xref': 'paper', 'yref': 'paper', 'x': 0.5, 'y': 0.5}]
+            }
+        }
+    dates = series['dates']
+    
+    # Visible window: the zoomed range or the selected period
+    x_range = relayout_x_range(relayout_data) if ctx.triggered_id == 'drilldown-graph' else None
+    if x_range is None:
+        x_range = (np.datetime64(f"{station['year_from']:04d}-01-01"),
+                   np.datetime64(f"{station['year_to'] + 1:04d}-01-01"))
+    
+    # Select the window (plus one point on each side, so the lines reach the border)
+    start = max(0, np.searchsorted(dates, x_range[0]) - 1)
+    end = min(len(dates), np.searchsorted(dates, x_range[1]) + 1)
+    
+    # About one point per pixel of the graph for each line
+    n_points = max(100, int(width))
+    
+    traces = []
+    for element, name, color in [('TMAX', 'Max.', '#ff0000'), ('TMIN', 'Min.', '#0000ff')]:
+        x, y = downsample_series(dates[start:end], series[element][start:end], n_points)
+        traces.append({'x': x, 'y': y, 'name': name, 'mode': 'lines',
+                       'line': {'color': color, 'width': 1}})
+    
+    return {
+        'data': traces,
+        'layout': {
+            'xaxis': {'title': 'Datum'},
+            'yaxis': {'title': 'Temperatur in Grad C', 'fixedrange': True},
+            'hovermode': 'x unified',
+            'margin': {'t': 20},
+            # Keep the zoom when the data of a new window is sent
+            'uirevision': f"{station['station_id']}-{resolution}-{station['year_from']}-{station['year_to']}"
+        }
+    }
+
+DEBUG = True
+
+# Keep the data up to date in every process that serves the app, also under a WSGI
+# server (e.g. 'gunicorn main:app.server'). With the debug reloader the script runs twice:
+# the parent process only watches the files and restarts the child that serves the app,
+# so the parent doesn't get a refresher.
+if not (__name__ == '__main__' and DEBUG and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'):
+    start_refresher(on_catalog_update=reload_stations)
+
 # Run the app
 if __name__ == '__main__':
-    app.run_server(debug=True)
\ No newline at end of file
+    app.run_server(debug=DEBUG)
\ No newline at end of file
@@ -0,0 +1,69 @@
+import numpy as np
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:  # Optional, gzip is used without it
+    brotli = None
+
+# The 'map_payload.py' module prepares the station layer of the map.
+# Instead of embedding a plotly figure with every station in the page, the coordinates
+# and names are packed into a small binary payload and compressed once when the catalog
+# is loaded. The browser downloads it from MAP_PAYLOAD_URL (see 'api.py'), keeps it in
+# its cache and only checks the ETag on repeat visits, then builds the map trace itself.
+#
+# Layout of the payload (little-endian):
+#   uint32       number of stations n
+#   int32 * n    latitudes in 1/10000 degree, sorted, stored as differences to the previous one
+#   int32 * n    longitudes in 1/10000 degree
+#   utf-8        station names separated by '\n'
+# The catalog has four decimal places, so the coordinates are exact. The sorted
+# latitudes have small differences, which compress much better than the values.
+
+MAP_PAYLOAD_URL = "/station-map-payload"
+
+COORDINATE_SCALE = 10000
+
+
+def encode_map_payload(stations_df):
+    """
+    Packs the coordinates and names of all stations, see the layout above.
+
+    Args:
+        stations_df (pd.DataFrame): The station catalog
+
+    Returns:
+        bytes: The uncompressed payload
+    """
+    order = np.argsort(stations_df['Latitude'].values, kind='stable')
+    latitudes = np.round(stations_df['Latitude'].values[order] * COORDINATE_SCALE).astype('<i4')
+    longitudes = np.round(stations_df['Longitude'].values[order] * COORDINATE_SCALE).astype('<i4')
+    names = stations_df['Station_Name'].fillna('').astype(str).values[order]
+
+    return b''.join([
+        np.array([len(order)], dtype='<u4').tobytes(),
+        np.diff(latitudes, prepend=0).astype('<i4').tobytes(),
+        longitudes.tobytes(),
+        '\n'.join(name.replace('\n', ' ') for name in names).encode('utf-8')
+    ])
+
+
+def build_map_payload(stations_df):
+    """
+    Creates the compressed station layer of the map.
+
+    Args:
+        stations_df (pd.DataFrame): The station catalog
+
+    Returns:
+        dict: 'etag', the payload as 'identity' and compressed as 'gzip' and 'br'
+              ('br' is None if brotli is not installed)
+    """
+    content = encode_map_payload(stations_df)
+    return {
+        'etag': hashlib.sha1(content).hexdigest(),
+        'identity': content,
+        'gzip': gzip.compress(content, compresslevel=9),
+        'br': brotli.compress(content, quality=9) if brotli is not None else None
+    }
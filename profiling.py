@@ -0,0 +1,112 @@
+import cProfile
+import functools
+import inspect
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+# The 'profiling.py' module can profile single requests with cProfile, to find out
+# whether a slow station click is caused by the download, the cleaning or the averages.
+# Functions are wrapped with @profiled(...); a profile is written for the outermost
+# wrapped function of a request, the wrapped functions it calls are part of that profile.
+#
+# PROFILING                  1 enables the profiler (default 0, the functions are not wrapped)
+# PROFILE_DIR                directory for the '.prof' files (default ./data/profiles)
+# PROFILE_SAMPLE_RATE        share of the calls that are profiled, 0 to 1 (default 1)
+# PROFILE_MAX_PER_MINUTE     maximum number of profiles per minute and process (default 10)
+#
+# Only one request is profiled at a time per process, calls in other threads run
+# normally in the meantime. The files can be viewed with e.g. 'snakeviz' or
+# 'python -m pstats <file>'.
+
+PROFILING = os.environ.get('PROFILING', '0') == '1'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', "./data/profiles")
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 1.0))
+PROFILE_MAX_PER_MINUTE = int(os.environ.get('PROFILE_MAX_PER_MINUTE', 10))
+
+_profile_lock = threading.Lock()
+_recent_profiles = deque()
+_state = threading.local()
+
+
+def _should_profile():
+    """
+    Decides with the sample rate and the per-minute limit if a call is profiled.
+    """
+    if random.random() >= PROFILE_SAMPLE_RATE:
+        return False
+    now = time.monotonic()
+    while _recent_profiles and now - _recent_profiles[0] > 60:
+        _recent_profiles.popleft()
+    if len(_recent_profiles) >= PROFILE_MAX_PER_MINUTE:
+        return False
+    _recent_profiles.append(now)
+    return True
+
+
+def _profile_file(name, station_id, duration_ms):
+    """
+    Path of a profile, e.g. '20240101-120000_display_yearly_data_GM000000001_1234ms.prof'.
+    """
+    station = re.sub(r'[^A-Za-z0-9]', '', str(station_id)) if station_id else 'none'
+    timestamp = time.strftime('%Y%m%d-%H%M%S')
+    return f"{PROFILE_DIR}/{timestamp}_{name}_{station}_{duration_ms:.0f}ms.prof"
+
+
+def profiled(name=None, station_id=None):
+    """
+    Decorator that profiles a function if PROFILING is enabled.
+
+    Args:
+        name (str): Name used in the file name, default the function name
+        station_id (callable): Gets the arguments of a call as dict and returns the
+                               station ID for the file name; by default the argument
+                               'station_id' is used if the function has one
+
+    Returns:
+        callable: The decorator
+    """
+    def decorator(function):
+        if not PROFILING:
+            return function
+
+        profile_name = name or function.__name__
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # Nested calls are part of the outer profile, other threads wait for no one
+            if getattr(_state, 'active', False) or not _profile_lock.acquire(blocking=False):
+                return function(*args, **kwargs)
+            try:
+                if not _should_profile():
+                    return function(*args, **kwargs)
+
+                _state.active = True
+                profile = cProfile.Profile()
+                start = time.perf_counter()
+                try:
+                    return profile.runcall(function, *args, **kwargs)
+                finally:
+                    duration_ms = (time.perf_counter() - start) * 1000
+                    _state.active = False
+                    try:
+                        arguments = signature.bind(*args, **kwargs).arguments
+                        current_station = (station_id(arguments) if station_id is not None
+                                           else arguments.get('station_id'))
+                    except Exception:
+                        current_station = None
+                    try:
+                        os.makedirs(PROFILE_DIR, exist_ok=True)
+                        profile.dump_stats(_profile_file(profile_name, current_station, duration_ms))
+                    except OSError as e:
+                        print(f"Error writing profile of {profile_name}: {e}")
+            finally:
+                _profile_lock.release()
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl, every process refreshes on its own there
+    fcntl = None
+
+from http_client import catalog_url, station_url, remote_modified_time
+from data_loader import download_catalog_files
+from clean_data import build_station_catalog
+from year_coverage import COVERAGE_FILE, rebuild_catalog_coverage, update_station_coverage, update_archive_coverage
+from station_store import STATION_DIR, cached_station_ids, station_file, refresh_station_files
+
+# The 'refresher.py' module keeps the station catalog and the cached stations up to date
+# while the app is running. A background thread runs an asyncio loop that checks the
+# source (NOAA or the mirror set with GHCN_BASE_URL) in a fixed interval and downloads
+# files that changed. New files are built next to the old ones and swapped in with
+# os.replace, so the app keeps serving the old data until the new data is complete.
+# Afterwards the exact years of all stations are read from the bulk archive when needed
+# and enabled with COVERAGE_SOURCE=archive (see update_archive_coverage() in 'year_coverage.py').
+#
+# Every server process runs a refresher, so each one reloads the catalog when it changed.
+# Only one process at a time downloads (REFRESH_LOCK_FILE), the others skip that round
+# and notice the new catalog by its modification time.
+#
+# REFRESH_INTERVAL_HOURS  hours between two checks, 0 disables the refresher (default 24)
+# REFRESH_CONCURRENCY     number of downloads running at the same time (default 4)
+
+REFRESH_INTERVAL_HOURS = float(os.environ.get('REFRESH_INTERVAL_HOURS', 24))
+REFRESH_CONCURRENCY = int(os.environ.get('REFRESH_CONCURRENCY', 4))
+
+CATALOG_FILE = "./data/stations.csv"
+CATALOG_STAGING_DIR = "./data/.staging"
+REFRESH_LOCK_FILE = "./data/.refresher.lock"
+
+# Seconds between two checks whether another process replaced the catalog
+CATALOG_CHECK_SECONDS = 60
+
+
+def _catalog_mtime():
+    return os.path.getmtime(CATALOG_FILE) if os.path.exists(CATALOG_FILE) else None
+
+
+def _try_lock():
+    """
+    Takes the refresh lock without waiting.
+
+    Returns:
+        file object: The open lock file (close it to release the lock), None if
+                     another process is refreshing
+    """
+    os.makedirs(os.path.dirname(REFRESH_LOCK_FILE), exist_ok=True)
+    lock_file = open(REFRESH_LOCK_FILE, 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+    return lock_file
+
+
+def _is_outdated(url, local_file):
+    """
+    Checks if the source file is newer than the local file.
+    If the source doesn't tell its modification time, the file is treated as outdated.
+    """
+    if not os.path.exists(local_file):
+        return True
+    remote_time = remote_modified_time(url)
+    return remote_time is None or remote_time > os.path.getmtime(local_file)
+
+
+def refresh_catalog():
+    """
+    Downloads the station list and inventory again if they changed and
+    replaces 'stations.csv' with the newly built catalog.
+
+    Returns:
+        bool: True if the catalog was replaced
+    """
+    if not (_is_outdated(catalog_url("ghcnd-stations.csv"), CATALOG_FILE) or
+            _is_outdated(catalog_url("ghcnd-inventory.txt"), CATALOG_FILE)):
+        return False
+
+    try:
+        download_catalog_files(CATALOG_STAGING_DIR)
+        stations_df = build_station_catalog(f"{CATALOG_STAGING_DIR}/stations.csv",
+                                            f"{CATALOG_STAGING_DIR}/inventory.txt")
+        stations_df.to_csv(f"{CATALOG_STAGING_DIR}/catalog.csv", index=False)
+        rebuild_catalog_coverage(stations_df, COVERAGE_FILE, f"{CATALOG_STAGING_DIR}/coverage.npz")
+        os.replace(f"{CATALOG_STAGING_DIR}/coverage.npz", COVERAGE_FILE)
+        os.replace(f"{CATALOG_STAGING_DIR}/catalog.csv", CATALOG_FILE)
+    finally:
+        shutil.rmtree(CATALOG_STAGING_DIR, ignore_errors=True)
+
+    # The downloaded stations know their exact years
+    for station_id in cached_station_ids():
+        update_station_coverage(station_id, station_file(station_id, 'raw'))
+
+    print("Refreshed station catalog stations.csv")
+    return True
+
+
+def refresh_station(station_id):
+    """
+    Downloads a cached station again if its '.dly' file changed.
+
+    Returns:
+        bool: True if the station files were replaced
+    """
+    if not _is_outdated(station_url(station_id), station_file(station_id, 'raw')):
+        return False
+    return refresh_station_files(station_id)
+
+
+async def refresh_all():
+    """
+    Checks the catalog and all cached stations once, with at most
+    REFRESH_CONCURRENCY downloads at the same time. Skipped if another
+    process is refreshing.
+    """
+    semaphore = asyncio.Semaphore(REFRESH_CONCURRENCY)
+
+    async def run(name, function, *args):
+        async with semaphore:
+            try:
+                # The downloads and pandas are blocking, so they run in worker threads
+                return await asyncio.to_thread(function, *args)
+            except Exception as e:
+                print(f"Error refreshing {name}: {e}")
+                return False
+
+    lock_file = _try_lock()
+    if lock_file is None:
+        print("Refresh skipped, another process is refreshing")
+        return
+    try:
+        catalog_task = run('station catalog', refresh_catalog)
+        station_tasks = [run(f"station {station_id}", refresh_station, station_id)
+                         for station_id in cached_station_ids()]
+        catalog_updated, *stations_updated = await asyncio.gather(catalog_task, *station_tasks)
+
+        # Exact years of the whole catalog from the bulk archive, after the catalog is complete
+        coverage_updated = await run('year coverage', update_archive_coverage)
+    finally:
+        lock_file.close()
+
+    print(f"Refresh finished: catalog {'updated' if catalog_updated else 'unchanged'}, "
+          f"{sum(bool(updated) for updated in stations_updated)} of {len(stations_updated)} stations updated, "
+          f"year coverage {'updated' if coverage_updated else 'unchanged'}")
+
+
+async def _refresh_loop(interval, on_catalog_update):
+    loaded_mtime = _catalog_mtime()
+    loop = asyncio.get_running_loop()
+    next_refresh = loop.time()
+    while True:
+        if loop.time() >= next_refresh:
+            await refresh_all()
+            next_refresh = loop.time() + interval
+
+        # The catalog may have been replaced by this or by another process
+        mtime = _catalog_mtime()
+        if mtime != loaded_mtime:
+            loaded_mtime = mtime
+            if on_catalog_update is not None:
+                try:
+                    on_catalog_update()
+                except Exception as e:
+                    print(f"Error reloading the station catalog: {e}")
+        await asyncio.sleep(min(CATALOG_CHECK_SECONDS, max(0, next_refresh - loop.time())))
+
+
+def start_refresher(on_catalog_update=None):
+    """
+    Starts the refresher in a background thread.
+
+    Args:
+        on_catalog_update (callable): Called without arguments after the catalog was replaced
+
+    Returns:
+        threading.Thread: The started thread, None if the refresher is disabled
+    """
+    if REFRESH_INTERVAL_HOURS <= 0:
+        return None
+
+    os.makedirs(STATION_DIR, exist_ok=True)
+    thread = threading.Thread(
+        target=asyncio.run,
+        args=(_refresh_loop(REFRESH_INTERVAL_HOURS * 3600, on_catalog_update),),
+        name='station-refresher',
+        daemon=True
+    )
+    thread.start()
+    print(f"Started refresher, checking for new data every {REFRESH_INTERVAL_HOURS} hours")
+    return thread
@@ -0,0 +1,307 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import atexit
+import hashlib
+import threading
+from collections import OrderedDict
+from multiprocessing import shared_memory, resource_tracker
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl, the shared tier is disabled there
+    fcntl = None
+
+# The 'shared_arrays.py' module shares the averages of a station between the worker
+# processes of the server. The first process that needs a file reads it and publishes
+# it as one block in shared memory; every other process attaches the block and builds
+# a DataFrame on top of it without copying the numeric columns. The DataFrame is the
+# same as the one pd.read_csv() returns (same columns, order and dtypes).
+#
+# Every block lists the processes that hold it (their PIDs). A process holds at most
+# MAX_ATTACHED_BLOCKS blocks (the least recently used is released first) and gives all
+# of them back when it exits. The last process to release a block removes it. Blocks
+# of files that changed or were deleted, and blocks whose processes were all killed
+# before they could release them, are removed by remove_stale_blocks(). It runs when a
+# process uses the shared tier for the first time and when station files change.
+#
+# Layout of a block: header (rows, length of the metadata, holder PIDs), the metadata
+# as JSON (file, columns with their dtype and offset, values of the text columns) and
+# the values of every numeric column one after the other, each in its own dtype.
+#
+# Only used on Linux: POSIX shared memory is listed in /dev/shm there, and other
+# systems (e.g. macOS) limit the length of the block names.
+
+SHARED_STATION_CACHE = (os.environ.get('SHARED_STATION_CACHE', '1') == '1' and fcntl is not None and
+                        os.path.isdir('/dev/shm'))
+
+MAX_ATTACHED_BLOCKS = 32
+
+# Number of processes that can hold a block, more processes use it without being listed
+MAX_HOLDERS = 64
+
+BLOCK_PREFIX = 'ghcn_'
+LOCK_FILE = "./data/stations/.shared_memory.lock"
+
+HEADER_SIZE = 8 * (2 + MAX_HOLDERS)
+
+_attached = OrderedDict()
+_attached_lock = threading.Lock()
+_cleaned_up = False
+
+
+class _FileLock:
+    """
+    Lock shared by all processes, protects the holder lists.
+    """
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(LOCK_FILE), exist_ok=True)
+        self.file = open(LOCK_FILE, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def _block_name(path, mtime_ns):
+    """
+    Name of the block of a file version, e.g. 'ghcn_3f2a...' (29 characters, POSIX
+    shared memory names may be limited to 31).
+    """
+    key = f"{os.path.basename(path)}:{mtime_ns}"
+    return f"{BLOCK_PREFIX}{hashlib.sha1(key.encode('utf-8')).hexdigest()[:24]}"
+
+
+def _untrack(shm):
+    """
+    Stops the resource tracker from removing the block when this process exits,
+    the holder list decides when it is removed.
+    """
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+def _header(shm):
+    return np.ndarray((2 + MAX_HOLDERS,), dtype=np.int64, buffer=shm.buf)
+
+
+def _metadata(shm):
+    metadata_length = int(_header(shm)[1])
+    return json.loads(bytes(shm.buf[HEADER_SIZE:HEADER_SIZE + metadata_length]).decode('utf-8'))
+
+
+def _add_holder(shm):
+    holders = _header(shm)[2:]
+    free = np.flatnonzero(holders == 0)
+    if len(free):
+        holders[free[0]] = os.getpid()
+
+
+def _living_holders(shm):
+    """
+    Removes the processes that no longer exist from the holder list of a block.
+
+    Returns:
+        int: Number of processes that still hold the block
+    """
+    holders = _header(shm)[2:]
+    for slot in np.flatnonzero(holders):
+        try:
+            os.kill(int(holders[slot]), 0)
+        except ProcessLookupError:
+            holders[slot] = 0
+        except PermissionError:
+            pass  # The process exists but belongs to another user
+    return int(np.count_nonzero(holders))
+
+
+def _align(offset):
+    return (offset + 7) // 8 * 8
+
+
+def _publish(name, path, mtime_ns):
+    """
+    Reads a file and copies it into a new block.
+    Returns None if another process published the block first.
+    """
+    df = pd.read_csv(path)
+    numeric = [column for column in df.columns
+               if isinstance(df[column].dtype, np.dtype) and df[column].dtype.kind in 'biuf']
+
+    # The text columns (e.g. 'Station_ID') are small and go into the metadata
+    columns, offset = [], 0
+    for column in df.columns:
+        entry = {'name': column, 'dtype': str(df[column].dtype)}
+        if column in numeric:
+            entry['offset'] = offset
+            offset = _align(offset + df[column].dtype.itemsize * len(df))
+        columns.append(entry)
+    text = {column: df[column].tolist() for column in df.columns if column not in numeric}
+    metadata = json.dumps({'file': os.path.basename(path), 'mtime_ns': mtime_ns,
+                           'columns': columns, 'text': text}).encode('utf-8')
+    data_start = HEADER_SIZE + _align(len(metadata))
+
+    try:
+        shm = shared_memory.SharedMemory(name=name, create=True, size=data_start + max(8, offset))
+    except FileExistsError:
+        return None
+    _untrack(shm)
+
+    header = _header(shm)
+    header[:2] = [len(df), len(metadata)]
+    header[2:] = 0
+    _add_holder(shm)
+    shm.buf[HEADER_SIZE:HEADER_SIZE + len(metadata)] = metadata
+    for entry in columns:
+        if 'offset' in entry:
+            values = np.ndarray((len(df),), dtype=entry['dtype'], buffer=shm.buf,
+                                offset=data_start + entry['offset'])
+            values[:] = df[entry['name']].values
+    return shm
+
+
+def _attach(name):
+    """
+    Attaches an existing block and adds this process to its holders.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    _untrack(shm)
+    _add_holder(shm)
+    return shm
+
+
+def _frame(shm):
+    """
+    Builds a read-only DataFrame on top of a block without copying the numeric values.
+    """
+    n_rows = int(_header(shm)[0])
+    metadata = _metadata(shm)
+    data_start = HEADER_SIZE + _align(int(_header(shm)[1]))
+
+    data = {}
+    for entry in metadata['columns']:
+        if 'offset' in entry:
+            values = np.ndarray((n_rows,), dtype=entry['dtype'], buffer=shm.buf,
+                                offset=data_start + entry['offset'])
+            values.flags.writeable = False
+            data[entry['name']] = values
+        else:
+            data[entry['name']] = pd.Series(metadata['text'][entry['name']], dtype=entry['dtype'])
+    return pd.DataFrame(data, columns=[entry['name'] for entry in metadata['columns']], copy=False)
+
+
+def _release(name, shm):
+    """
+    Removes this process from the holders and removes the block if no process holds it.
+    """
+    with _FileLock():
+        holders = _header(shm)[2:]
+        holders[holders == os.getpid()] = 0
+        del holders
+        if _living_holders(shm) == 0:
+            # unlink() also unregisters the block from the resource tracker
+            resource_tracker.register(shm._name, 'shared_memory')
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                # Already removed by remove_stale_blocks()
+                _untrack(shm)
+    try:
+        shm.close()
+    except BufferError:
+        # DataFrames on top of the block are still in use, the memory is
+        # unmapped when they are garbage collected
+        pass
+
+
+def load_shared_frame(path):
+    """
+    Returns the content of a station file, shared with all other processes.
+    The DataFrame has the same columns and dtypes as pd.read_csv(path) and is read-only.
+
+    Args:
+        path (str): Path of a monthly, yearly or seasonal station file
+
+    Returns:
+        pd.DataFrame: The content of the file
+    """
+    global _cleaned_up
+    if not _cleaned_up:
+        # Blocks left behind by processes that were killed before this one started
+        remove_stale_blocks(os.path.dirname(path))
+        _cleaned_up = True
+
+    mtime_ns = os.stat(path).st_mtime_ns
+    name = _block_name(path, mtime_ns)
+
+    with _attached_lock:
+        if name in _attached:
+            _attached.move_to_end(name)
+            return _attached[name][1]
+
+        with _FileLock():
+            try:
+                shm = _attach(name)
+            except FileNotFoundError:
+                shm = _publish(name, path, mtime_ns) or _attach(name)
+        df = _frame(shm)
+        _attached[name] = (shm, df)
+
+        # Release the least recently used blocks
+        while len(_attached) > MAX_ATTACHED_BLOCKS:
+            old_name, (old_shm, old_df) = _attached.popitem(last=False)
+            del old_df
+            _release(old_name, old_shm)
+    return df
+
+
+def remove_stale_blocks(station_dir="./data/stations"):
+    """
+    Removes the blocks of files that were changed or deleted (e.g. after a refresh
+    or when a station was removed from the cache) and the blocks that are only held
+    by processes that no longer exist (e.g. killed workers). Processes that still
+    have such a block attached can keep using it until they release it.
+
+    Args:
+        station_dir (str): Directory of the station files
+    """
+    if not os.path.isdir('/dev/shm'):
+        return
+    with _FileLock():
+        for name in os.listdir('/dev/shm'):
+            if not name.startswith(BLOCK_PREFIX):
+                continue
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            except (OSError, ValueError):
+                continue
+            _untrack(shm)
+            try:
+                metadata = _metadata(shm)
+                path = f"{station_dir}/{metadata['file']}"
+                stale = (not os.path.exists(path) or os.stat(path).st_mtime_ns != metadata['mtime_ns'] or
+                         _living_holders(shm) == 0)
+            except (ValueError, KeyError):
+                # Not a block of this version
+                stale = True
+            shm.close()
+            if stale:
+                try:
+                    os.remove(f"/dev/shm/{name}")
+                except OSError:
+                    pass
+
+
+@atexit.register
+def _release_all():
+    with _attached_lock:
+        while _attached:
+            name, (shm, df) = _attached.popitem()
+            del df
+            _release(name, shm)
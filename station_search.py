@@ -0,0 +1,153 @@
+import numpy as np
+import re
+import unicodedata
+
+# The 'station_search.py' module finds stations by name or ID while the user types.
+# The index is built once from the catalog:
+#  - A sorted array of search keys (the station ID, the full name and the name from
+#    every following word on, e.g. 'TEMPELHOF' for 'BERLIN TEMPELHOF'). All keys starting
+#    with the query lie next to each other and are found with two binary searches.
+#  - Trigrams (groups of three characters) of every name, used if the query has no or
+#    only a few prefix matches, e.g. for typos or text from the middle of a word.
+
+# Minimum share of the query's trigrams a name needs to be a trigram match
+MIN_TRIGRAM_SHARE = 0.5
+
+# Marks the end of a prefix range, sorts after every other character
+_MAX_CHARACTER = '\U0010ffff'
+
+
+def normalize(text):
+    """
+    Converts a name or query to the form used in the index: upper case,
+    without accents, only letters, digits and single spaces.
+    """
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.sub(r'[^A-Z0-9]+', ' ', text.upper()).split())
+
+
+def _trigram_codes(texts):
+    """
+    Returns the trigrams of every text (padded with a space on both sides) as
+    integer codes, computed for all texts at once.
+
+    Args:
+        texts (list): Normalized texts (ASCII)
+
+    Returns:
+        tuple: (codes, position of the text of every code)
+    """
+    padded = np.array([f" {text} " for text in texts], dtype=bytes)
+    width = padded.dtype.itemsize
+    characters = padded.view(np.uint8).reshape(len(texts), width).astype(np.int64)
+    lengths = np.char.str_len(padded)
+
+    codes = (characters[:, :-2] << 16) | (characters[:, 1:-1] << 8) | characters[:, 2:]
+    valid = np.arange(width - 2) < (lengths - 2)[:, None]
+    positions = np.broadcast_to(np.arange(len(texts))[:, None], codes.shape)
+    return codes[valid], positions[valid]
+
+
+class StationSearchIndex:
+    """
+    Prefix and trigram index over the station names and IDs of the catalog.
+    """
+
+    def __init__(self, stations_df, trigrams=True):
+        """
+        Args:
+            stations_df (pd.DataFrame): The station catalog
+            trigrams (bool): Also build the trigram index for fuzzy matches
+        """
+        self.station_ids = stations_df['Station_ID'].astype(str).tolist()
+        self.names = stations_df['Station_Name'].fillna('').astype(str).tolist()
+        self.latitudes = stations_df['Latitude'].values
+        self.longitudes = stations_df['Longitude'].values
+        self.id_positions = {station_id: position for position, station_id in enumerate(self.station_ids)}
+
+        normalized_names = [normalize(name) for name in self.names]
+
+        keys, positions = [], []
+        for position, (station_id, name) in enumerate(zip(self.station_ids, normalized_names)):
+            keys.append(station_id.upper())
+            positions.append(position)
+            words = name.split(' ')
+            for i in range(len(words)):
+                keys.append(' '.join(words[i:]))
+                positions.append(position)
+
+        order = np.argsort(np.array(keys), kind='stable')
+        self.keys = np.array(keys)[order]
+        self.key_positions = np.array(positions, dtype=np.int64)[order]
+
+        self.trigram_postings = None
+        if trigrams:
+            # Every (trigram, station) pair once, grouped by trigram
+            codes, stations = _trigram_codes(normalized_names)
+            pairs = np.sort(codes * len(normalized_names) + stations)
+            pairs = pairs[np.r_[True, pairs[1:] != pairs[:-1]]]
+            codes, stations = pairs // len(normalized_names), pairs % len(normalized_names)
+            starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+            unique_codes = codes[starts]
+            self.trigram_postings = dict(zip(unique_codes.tolist(), np.split(stations, starts[1:])))
+
+    def _prefix_matches(self, query):
+        """
+        Positions of the stations with a key starting with the query, exact keys first.
+        """
+        start = np.searchsorted(self.keys, query, side='left')
+        end = np.searchsorted(self.keys, query + _MAX_CHARACTER, side='left')
+        return self.key_positions[start:end]
+
+    def _trigram_matches(self, query):
+        """
+        Positions of the stations sharing most trigrams with the query, best first.
+        """
+        query_codes = set(_trigram_codes([query])[0].tolist())
+        postings = [self.trigram_postings[code] for code in query_codes if code in self.trigram_postings]
+        if not postings:
+            return np.array([], dtype=np.int64)
+        counts = np.bincount(np.concatenate(postings), minlength=len(self.names))
+        candidates = np.flatnonzero(counts >= max(1, MIN_TRIGRAM_SHARE * len(query_codes)))
+        return candidates[np.argsort(-counts[candidates], kind='stable')]
+
+    def search(self, query, limit=10):
+        """
+        Finds the stations whose name or ID starts with the query, completed
+        with trigram matches if there are fewer than limit.
+
+        Args:
+            query (str): Text typed by the user
+            limit (int): Maximum number of results
+
+        Returns:
+            list: Dicts with Station_ID, Station_Name, Latitude and Longitude
+        """
+        query = normalize(query)
+        if not query:
+            return []
+
+        positions = list(dict.fromkeys(self._prefix_matches(query)[:limit * 4].tolist()))[:limit]
+        if len(positions) < limit and self.trigram_postings is not None and len(query) >= 3:
+            for position in self._trigram_matches(query)[:limit * 4].tolist():
+                if position not in positions:
+                    positions.append(position)
+                if len(positions) == limit:
+                    break
+
+        return [self._station(position) for position in positions]
+
+    def find(self, station_id):
+        """
+        Returns a station by its ID, None if it is not in the catalog.
+        """
+        position = self.id_positions.get(station_id)
+        return None if position is None else self._station(position)
+
+    def _station(self, position):
+        return {
+            'Station_ID': self.station_ids[position],
+            'Station_Name': self.names[position],
+            'Latitude': float(self.latitudes[position]),
+            'Longitude': float(self.longitudes[position])
+        }
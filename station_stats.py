@@ -0,0 +1,383 @@
+import pandas as pd
+import numpy as np
+import os
+from functools import lru_cache
+
+from clean_data import SEASONAL_SERIES
+from station_store import load_station_frame, station_file
+
+# The 'station_stats.py' module answers questions about the precomputed
+# 'station_id_seasonal.csv' files created by 'clean_data.py'.
+# Every mean over a year window is read from the prefix sums, so it takes constant
+# time no matter how many years the station has.
+
+# Number of years used for the "first N vs last N years" comparison
+SUMMARY_YEARS = 10
+
+# Regional mean: a year needs values from at least this share of the stations
+REGIONAL_MIN_SHARE = 0.5
+
+# Distances below this are treated as this distance when weighting (km)
+MIN_WEIGHT_DISTANCE = 1.0
+
+# Default baseline period of the anomalies (WMO reference period)
+BASELINE_FROM = 1961
+BASELINE_TO = 1990
+
+# Two-sided 95% quantiles of the t-distribution for 1 to 30 degrees of freedom
+T_QUANTILES_95 = np.array([
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042
+])
+
+
+def season_columns(is_northern):
+    """
+    Maps the column names of the seasonal table to the stored series.
+    On the southern hemisphere the seasons are shifted by half a year.
+
+    Args:
+        is_northern (bool): True if the station is on the northern hemisphere
+
+    Returns:
+        dict: Table column name -> series name in the seasonal file
+    """
+    if is_northern:
+        seasons = {'Winter': 'DJF', 'Frühling': 'MAM', 'Sommer': 'JJA', 'Herbst': 'SON'}
+    else:
+        seasons = {'Sommer': 'DJF', 'Herbst': 'MAM', 'Winter': 'JJA', 'Frühling': 'SON'}
+
+    columns = {
+        'Min. (jährlich)': 'TMIN',
+        'Max. (jährlich)': 'TMAX'
+    }
+    for name in ['Winter', 'Frühling', 'Sommer', 'Herbst']:
+        columns[f"{name}_Min"] = f"{seasons[name]}_TMIN"
+        columns[f"{name}_Max"] = f"{seasons[name]}_TMAX"
+    return columns
+
+
+def load_seasonal_sums(station_id, qc_policy='none'):
+    """
+    Loads the seasonal file of a station (cached, must not be changed).
+
+    Args:
+        station_id (str): The station ID to load
+        qc_policy (str): Quality control policy of the averages
+
+    Returns:
+        pd.DataFrame: One row per year with the series, prefix sums and counts
+    """
+    return load_station_frame(station_id, 'seasonal', qc_policy)
+
+
+def window_means(seasonal_df, year_from, year_to):
+    """
+    Calculates the mean of every series over the years year_from to year_to
+    (both included) using the prefix sums.
+
+    Args:
+        seasonal_df (pd.DataFrame): The seasonal file of a station
+        year_from (int): First year of the window
+        year_to (int): Last year of the window
+
+    Returns:
+        dict: Series name -> mean (None if there is no value in the window)
+    """
+    first_year = int(seasonal_df['Year'].iloc[0])
+    last_index = len(seasonal_df) - 1
+
+    # Convert the years to positions and clip them to the available years
+    start = max(0, year_from - first_year)
+    end = min(last_index, year_to - first_year)
+
+    means = {}
+    for series in SEASONAL_SERIES:
+        if start > end:
+            means[series] = None
+            continue
+        sums = seasonal_df[f"{series}_sum"].values
+        counts = seasonal_df[f"{series}_count"].values
+        total = sums[end] - (sums[start - 1] if start > 0 else 0)
+        count = counts[end] - (counts[start - 1] if start > 0 else 0)
+        means[series] = round(total / count, 2) if count > 0 else None
+    return means
+
+
+def period_summary(seasonal_df, year_from, year_to, is_northern, n_years=SUMMARY_YEARS):
+    """
+    Creates the summary rows shown below the seasonal table:
+    the mean over the selected period, the mean of the first and the last
+    n_years years of the period and the difference between the two.
+
+    Args:
+        seasonal_df (pd.DataFrame): The seasonal file of a station
+        year_from (int): First year of the selected period
+        year_to (int): Last year of the selected period
+        is_northern (bool): True if the station is on the northern hemisphere
+        n_years (int): Number of years for the first/last comparison
+
+    Returns:
+        pd.DataFrame: Summary rows with the same columns as the seasonal table
+    """
+    # Restrict the period to the years the station actually has data for
+    year_from = max(year_from, int(seasonal_df['Year'].iloc[0]))
+    year_to = min(year_to, int(seasonal_df['Year'].iloc[-1]))
+    if year_from > year_to:
+        return pd.DataFrame()
+
+    # Use at most half of the period, so the first and last years don't overlap
+    n_years = max(1, min(n_years, (year_to - year_from + 1) // 2))
+
+    periods = [
+        (f"Mittel {year_from}-{year_to}", year_from, year_to),
+        (f"Erste {n_years} J. ({year_from}-{year_from + n_years - 1})",
+         year_from, year_from + n_years - 1),
+        (f"Letzte {n_years} J. ({year_to - n_years + 1}-{year_to})",
+         year_to - n_years + 1, year_to)
+    ]
+
+    columns = season_columns(is_northern)
+    rows = []
+    for label, start, end in periods:
+        means = window_means(seasonal_df, start, end)
+        row = {'Jahr': label}
+        row.update({column: means[series] for column, series in columns.items()})
+        rows.append(row)
+
+    # Difference between the last and the first years
+    difference = {'Jahr': 'Differenz (Letzte - Erste)'}
+    for column in columns:
+        first, last = rows[1][column], rows[2][column]
+        difference[column] = round(last - first, 2) if first is not None and last is not None else None
+    rows.append(difference)
+
+    return pd.DataFrame(rows)
+
+
+def seasonal_table(seasonal_df, year_from, year_to, is_northern):
+    """
+    Creates the seasonal table (one row per year) for the selected period.
+
+    Args:
+        seasonal_df (pd.DataFrame): The seasonal file of a station
+        year_from (int): First year of the selected period
+        year_to (int): Last year of the selected period
+        is_northern (bool): True if the station is on the northern hemisphere
+
+    Returns:
+        pd.DataFrame: Table with the column 'Jahr' and the ten Min/Max columns
+    """
+    columns = season_columns(is_northern)
+
+    table_df = seasonal_df[
+        (seasonal_df['Year'] >= year_from) &
+        (seasonal_df['Year'] <= year_to)
+    ]
+
+    # Skip the empty rows of years without any data
+    table_df = table_df.dropna(subset=list(columns.values()), how='all')
+
+    table_df = table_df[['Year'] + list(columns.values())]
+    table_df.columns = ['Jahr'] + list(columns.keys())
+    return table_df.replace({np.nan: None})
+
+
+def station_weights(distances, weighting='distance'):
+    """
+    Weights of the stations for the regional mean.
+
+    Args:
+        distances (array-like): Distance of every station to the search point in km
+        weighting (str): 'distance' for inverse distance squared, 'equal' for a simple mean
+
+    Returns:
+        np.ndarray: One weight per station
+    """
+    distances = np.asarray(distances, dtype=float)
+    if weighting == 'equal':
+        return np.ones(len(distances))
+    return 1.0 / np.maximum(distances, MIN_WEIGHT_DISTANCE) ** 2
+
+
+def regional_matrix(stations, year_from, year_to, qc_policy='none'):
+    """
+    Aligns the yearly and seasonal series of several stations on the same years.
+    The seasons are mapped per station, so stations on the southern hemisphere
+    contribute their own winter to 'Winter'.
+
+    Args:
+        stations (list): Dicts with 'Station_ID' and 'Latitude'; the seasonal file must exist
+        year_from (int): First year
+        year_to (int): Last year
+        qc_policy (str): Quality control policy of the averages
+
+    Returns:
+        tuple: (years, list of table column names, array of shape (columns, years, stations)
+               with NaN where a station has no value)
+    """
+    years = np.arange(year_from, year_to + 1)
+    columns = list(season_columns(True))
+    values = np.full((len(columns), len(years), len(stations)), np.nan)
+
+    for i, station in enumerate(stations):
+        seasonal_df = load_seasonal_sums(station['Station_ID'], qc_policy)
+        series = list(season_columns(station['Latitude'] >= 0).values())
+        positions = seasonal_df['Year'].values.astype(int) - year_from
+        inside = (positions >= 0) & (positions < len(years))
+        values[:, positions[inside], i] = seasonal_df[series].values[inside].T
+
+    return years, columns, values
+
+
+def regional_means(stations, year_from, year_to, qc_policy='none', weighting='distance',
+                   min_share=REGIONAL_MIN_SHARE):
+    """
+    Creates the regional mean of several stations for every year and series.
+    A year is only shown for a series if at least min_share of the stations
+    have a value, otherwise a few stations would decide the mean of the region.
+
+    Args:
+        stations (list): Dicts with 'Station_ID', 'Latitude' and 'Distance'
+        year_from (int): First year of the selected period
+        year_to (int): Last year of the selected period
+        qc_policy (str): Quality control policy of the averages
+        weighting (str): 'distance' or 'equal', see station_weights()
+        min_share (float): Share of the stations needed for a year (0 to 1)
+
+    Returns:
+        pd.DataFrame: Table with the column 'Jahr', the ten Min/Max columns and
+                      'Stationen' (number of stations with a yearly value)
+    """
+    years, columns, values = regional_matrix(stations, year_from, year_to, qc_policy)
+    weights = station_weights([station['Distance'] for station in stations], weighting)
+
+    # All series and years at once: weights of the stations that have a value
+    has_value = ~np.isnan(values)
+    value_weights = has_value * weights
+    total_weight = value_weights.sum(axis=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(has_value, values, 0).dot(weights) / total_weight
+    n_stations = has_value.sum(axis=2)
+    means[n_stations < max(1, min_share * len(stations))] = np.nan
+
+    table_df = pd.DataFrame(np.round(means.T, 2), columns=columns)
+    table_df.insert(0, 'Jahr', years)
+    table_df['Stationen'] = n_stations[columns.index('Min. (jährlich)')]
+
+    # Skip the years without any regional value
+    table_df = table_df.dropna(subset=columns, how='all')
+    return table_df.replace({np.nan: None})
+
+
+def t_quantile_95(degrees_of_freedom):
+    """
+    Two-sided 95% quantile of the t-distribution, from the table up to 30 degrees
+    of freedom and from the Cornish-Fisher expansion above.
+
+    Args:
+        degrees_of_freedom (np.ndarray): Degrees of freedom (at least 1)
+
+    Returns:
+        np.ndarray: The quantiles
+    """
+    df = np.maximum(np.asarray(degrees_of_freedom, dtype=float), 1)
+    z = 1.959964
+    expansion = z + (z**3 + z) / (4 * df) + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * df**2)
+    table = T_QUANTILES_95[np.minimum(df, 30).astype(int) - 1]
+    return np.where(df <= 30, table, expansion)
+
+
+def linear_trends(years, values):
+    """
+    Fits a least-squares line to every column of a matrix at once. Missing
+    values are left out per column, so every column uses its own years.
+
+    Args:
+        years (np.ndarray): The years, one per row
+        values (np.ndarray): Matrix with one row per year and one column per series (NaN if missing)
+
+    Returns:
+        tuple: (slope per year, half width of the 95% confidence interval of the slope,
+               number of years) per column; NaN if a column has less than 3 values
+    """
+    has_value = ~np.isnan(values)
+    y = np.where(has_value, values, 0.0)
+    x = np.where(has_value, np.asarray(years, dtype=float)[:, None], 0.0)
+    n = has_value.sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = x.sum(axis=0) / n
+        y_mean = y.sum(axis=0) / n
+        dx = np.where(has_value, x - x_mean, 0.0)
+        dy = np.where(has_value, y - y_mean, 0.0)
+        sxx = (dx * dx).sum(axis=0)
+        slope = (dx * dy).sum(axis=0) / sxx
+
+        residuals = dy - slope * dx
+        standard_error = np.sqrt((residuals * residuals).sum(axis=0) / (n - 2) / sxx)
+        interval = t_quantile_95(n - 2) * standard_error
+
+    too_short = n < 3
+    slope[too_short] = np.nan
+    interval[too_short] = np.nan
+    return slope, interval, n
+
+
+@lru_cache(maxsize=32)
+def _station_trends(station_id, qc_policy, mtime, year_from, year_to, is_northern, baseline_from, baseline_to):
+    """
+    Builds the trend and anomaly tables of a station, see station_trends().
+    """
+    seasonal_df = load_seasonal_sums(station_id, qc_policy)
+    columns = season_columns(is_northern)
+
+    table_df = seasonal_df[(seasonal_df['Year'] >= year_from) & (seasonal_df['Year'] <= year_to)]
+    years = table_df['Year'].values
+    values = table_df[list(columns.values())].to_numpy(dtype=float)
+
+    slope, interval, n = linear_trends(years, values)
+    baseline = window_means(seasonal_df, baseline_from, baseline_to)
+    baseline = np.array([np.nan if baseline[series] is None else baseline[series]
+                         for series in columns.values()])
+
+    def row(label, row_values):
+        return {'Jahr': label, **{column: None if np.isnan(value) else round(float(value), 2)
+                                  for column, value in zip(columns, row_values)}}
+
+    trend_df = pd.DataFrame([
+        row('Trend (°C/Dekade)', slope * 10),
+        row('95%-Konfidenzintervall (±)', interval * 10),
+        row(f"Mittel {baseline_from}-{baseline_to}", baseline)
+    ])
+
+    anomaly_df = pd.DataFrame(np.round(values - baseline, 2), columns=list(columns))
+    anomaly_df.insert(0, 'Jahr', years.astype(int))
+    anomaly_df = anomaly_df.dropna(subset=list(columns), how='all')
+    return trend_df, anomaly_df.replace({np.nan: None})
+
+
+def station_trends(station_id, year_from, year_to, is_northern, baseline_from=BASELINE_FROM,
+                   baseline_to=BASELINE_TO, qc_policy='none'):
+    """
+    Calculates the linear trend of all ten Min/Max columns of the seasonal table
+    over the selected period and their anomalies against a baseline period.
+    The result is cached until the station's seasonal file changes and must not be changed.
+
+    Args:
+        station_id (str): The station ID
+        year_from (int): First year of the selected period
+        year_to (int): Last year of the selected period
+        is_northern (bool): True if the station is on the northern hemisphere
+        baseline_from (int): First year of the baseline period
+        baseline_to (int): Last year of the baseline period
+        qc_policy (str): Quality control policy of the averages
+
+    Returns:
+        tuple: (trend table with the rows trend, confidence interval and baseline mean,
+               anomaly table with one row per year), both with the columns of the seasonal table
+    """
+    mtime = os.path.getmtime(station_file(station_id, 'seasonal', qc_policy))
+    return _station_trends(station_id, qc_policy, mtime, year_from, year_to, is_northern,
+                           baseline_from, baseline_to)
@@ -0,0 +1,442 @@
+import pandas as pd
+import numpy as np
+import os
+import glob
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+
+from data_loader import download_station_data
+from clean_data import (clean_station_data, create_monthly_averages, create_yearly_averages,
+                        create_seasonal_sums, qc_mask, qc_suffix, read_station_raw, QC_POLICIES)
+from year_coverage import update_station_coverage
+from profiling import profiled
+from shared_arrays import SHARED_STATION_CACHE, load_shared_frame, remove_stale_blocks
+
+# The 'station_store.py' module manages the downloaded station files in './data/stations'.
+# For every station there are four files: the raw daily values (with the flag codes) and
+# the monthly, yearly and seasonal averages. Averages for a quality control policy other
+# than 'none' are stored in additional files with the policy as suffix and are created
+# from the raw file when they are first needed.
+# Only the most recently downloaded stations are kept.
+
+STATION_DIR = "./data/stations"
+
+# Maximum number of stations kept on disk
+MAX_CACHED_STATIONS = 10
+
+# Number of stations downloaded at the same time by ensure_stations_data()
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 4))
+
+# File name suffix for every kind of station data
+STATION_FILE_SUFFIXES = {
+    'raw': '',
+    'monthly': '_monthly',
+    'yearly': '_yearly',
+    'seasonal': '_seasonal'
+}
+
+# Protects the cache when several stations are downloaded at the same time
+_cache_lock = threading.Lock()
+
+# Lock and number of waiting threads per station that is currently processed
+_station_locks = {}
+
+# Stations that are being downloaded, they already count as cached
+_reserved_stations = set()
+
+# Number of running exports per station, these stations are never removed from the cache
+_pinned_stations = {}
+
+
+def station_file(station_id, kind='raw', qc_policy='none'):
+    """
+    Returns the path of a station file.
+
+    Args:
+        station_id (str): The station ID
+        kind (str): One of 'raw', 'monthly', 'yearly' or 'seasonal'
+        qc_policy (str): Quality control policy of the averages (ignored for 'raw')
+
+    Returns:
+        str: Path of the CSV file
+    """
+    if kind == 'raw':
+        return f"{STATION_DIR}/{station_id}.csv"
+    return f"{STATION_DIR}/{station_id}{STATION_FILE_SUFFIXES[kind]}{qc_suffix(qc_policy)}.csv"
+
+
+def _has_flags(station_id):
+    """
+    Checks if the raw file of a station contains the flags as characters.
+    Stations downloaded by older versions don't have them or store them as
+    decimal codes (quality flags are letters, so a digit marks the old format).
+    """
+    first_row = pd.read_csv(station_file(station_id, 'raw'), nrows=1, dtype=str, keep_default_na=False)
+    if 'QFlag' not in first_row.columns:
+        return False
+    return first_row.empty or not first_row['QFlag'].iloc[0].isdigit()
+
+
+def reserve_cache_slot(station_id, keep=()):
+    """
+    Reserves a place in the cache for a station that is about to be downloaded and
+    removes the files of the oldest stations until there is room for it. Stations
+    that are being downloaded count as cached, so parallel downloads never fill the
+    cache beyond MAX_CACHED_STATIONS. Every call must be followed by a call of
+    release_cache_slot() once the download is finished.
+    Stations in keep are never removed, so a batch of downloads doesn't remove
+    its own stations, and neither are pinned stations (see pin_stations()) nor
+    stations that are being downloaded.
+
+    Args:
+        station_id (str): The station that will be downloaded
+        keep (iterable): IDs of stations that must stay in the cache
+    """
+    with _cache_lock:
+        station_files = [f for f in os.listdir(STATION_DIR) if f.endswith('_yearly.csv')]
+
+        # Get creation times for all station files
+        station_times = []
+        for fname in station_files:
+            station_id_from_file = fname.replace('_yearly.csv', '')
+            files_to_check = [station_file(station_id_from_file, kind) for kind in STATION_FILE_SUFFIXES]
+            # Use the oldest file's creation time for each station
+            creation_times = []
+            for f in files_to_check:
+                try:
+                    creation_times.append(os.path.getctime(f))
+                except FileNotFoundError:
+                    pass  # Missing or removed by another server process
+            if creation_times:
+                station_times.append((station_id_from_file, min(creation_times)))
+
+        _reserved_stations.add(station_id)
+        cached = {station for station, _ in station_times} | _reserved_stations
+        removable = sorted((t for t in station_times
+                            if t[0] not in keep and t[0] not in _pinned_stations and t[0] not in _reserved_stations),
+                           key=lambda x: x[1])
+        n_remove = min(len(removable), len(cached) - MAX_CACHED_STATIONS)
+        if n_remove <= 0:
+            return
+
+        # Remove the oldest stations' files, including the averages of all policies
+        for oldest_station, _ in removable[:n_remove]:
+            for old_file in glob.glob(f"{STATION_DIR}/{oldest_station}*.csv"):
+                try:
+                    os.remove(old_file)
+                except FileNotFoundError:
+                    pass  # Removed by another server process at the same time
+        if SHARED_STATION_CACHE:
+            remove_stale_blocks(STATION_DIR)
+
+
+def release_cache_slot(station_id):
+    """
+    Releases the place reserved by reserve_cache_slot(), the station counts
+    as cached through its files from now on.
+
+    Args:
+        station_id (str): The station ID
+    """
+    with _cache_lock:
+        _reserved_stations.discard(station_id)
+
+
+def cached_station_ids():
+    """
+    Returns the IDs of all stations currently kept on disk.
+    """
+    if not os.path.isdir(STATION_DIR):
+        return []
+    return [f.replace('_yearly.csv', '') for f in os.listdir(STATION_DIR) if f.endswith('_yearly.csv')]
+
+
+def pin_stations(station_ids):
+    """
+    Protects stations from being removed from the cache, e.g. while they are exported.
+    Every call must be followed by a call of unpin_stations() with the same IDs.
+
+    Args:
+        station_ids (list): The station IDs
+    """
+    with _cache_lock:
+        for station_id in station_ids:
+            _pinned_stations[station_id] = _pinned_stations.get(station_id, 0) + 1
+
+
+def unpin_stations(station_ids):
+    """
+    Allows stations pinned by pin_stations() to be removed from the cache again.
+
+    Args:
+        station_ids (list): The station IDs
+    """
+    with _cache_lock:
+        for station_id in station_ids:
+            _pinned_stations[station_id] -= 1
+            if _pinned_stations[station_id] <= 0:
+                del _pinned_stations[station_id]
+
+
+@contextmanager
+def _station_lock(station_id):
+    """
+    Holds the lock of a station. The lock is removed again when no thread uses
+    it, so only the stations that are currently being processed have one.
+    """
+    with _cache_lock:
+        entry = _station_locks.setdefault(station_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _cache_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _station_locks[station_id]
+
+
+@profiled()
+def ensure_station_data(station_id, qc_policy='none', keep=()):
+    """
+    Makes sure all files of a station exist. Missing stations are downloaded
+    and processed, the oldest station is removed if the cache is full.
+    The averages for the quality control policy are created from the raw
+    file if they are missing, without downloading the station again.
+
+    Args:
+        station_id (str): The station ID
+        qc_policy (str): Quality control policy of the averages
+        keep (iterable): IDs of stations that must not be removed from the cache
+
+    Returns:
+        bool: True if all files exist, False if failed
+    """
+    os.makedirs(STATION_DIR, exist_ok=True)
+
+    # Two requests for the same station must not process it at the same time
+    with _station_lock(station_id):
+        return _ensure_station_files(station_id, qc_policy, keep)
+
+
+def ensure_stations_data(station_ids, qc_policy='none'):
+    """
+    Makes sure all files of several stations exist, downloading up to
+    INGEST_WORKERS stations at the same time. The stations don't remove
+    each other from the cache.
+
+    Args:
+        station_ids (list): The station IDs (at most MAX_CACHED_STATIONS)
+        qc_policy (str): Quality control policy of the averages
+
+    Returns:
+        list: The IDs of the stations whose files exist, in the given order
+    """
+    keep = set(station_ids)
+    with ThreadPoolExecutor(max_workers=max(1, INGEST_WORKERS)) as executor:
+        results = list(executor.map(lambda station_id: ensure_station_data(station_id, qc_policy, keep),
+                                    station_ids))
+    return [station_id for station_id, success in zip(station_ids, results) if success]
+
+
+def _ensure_station_files(station_id, qc_policy, keep):
+    """
+    Creates the missing files of a station, see ensure_station_data().
+    """
+    # Check if we need to download new station data
+    if not (os.path.exists(station_file(station_id, 'raw')) and
+            os.path.exists(station_file(station_id, 'monthly')) and
+            os.path.exists(station_file(station_id, 'yearly')) and
+            _has_flags(station_id)):
+        reserve_cache_slot(station_id, keep=keep)
+        try:
+            # Now download and process the new station data
+            if download_station_data(station_id):
+                if clean_station_data(station_id):
+                    if create_monthly_averages(station_id):
+                        if create_yearly_averages(station_id):
+                            create_seasonal_sums(station_id)
+                    # Store the exact years the station covers for the search
+                    update_station_coverage(station_id, station_file(station_id, 'raw'))
+        finally:
+            release_cache_slot(station_id)
+    elif not os.path.exists(station_file(station_id, 'seasonal')):
+        # Station was cached before the seasonal sums existed
+        create_seasonal_sums(station_id)
+
+    # Aggregate again with the quality control policy, the raw file already has the flags
+    if qc_policy != 'none' and os.path.exists(station_file(station_id, 'raw')):
+        if not os.path.exists(station_file(station_id, 'monthly', qc_policy)):
+            create_monthly_averages(station_id, qc_policy)
+        if not os.path.exists(station_file(station_id, 'yearly', qc_policy)):
+            create_yearly_averages(station_id, qc_policy)
+        if not os.path.exists(station_file(station_id, 'seasonal', qc_policy)):
+            create_seasonal_sums(station_id, qc_policy)
+
+    return all(os.path.exists(station_file(station_id, kind, qc_policy)) for kind in STATION_FILE_SUFFIXES)
+
+
+def refresh_station_files(station_id):
+    """
+    Downloads and processes a cached station again and swaps the new files in.
+    All files are created in a staging directory first and then moved over the
+    old ones with os.replace, so readers never see a half-written file.
+    The averages are created for every quality control policy that is cached.
+
+    Args:
+        station_id (str): The station ID
+
+    Returns:
+        bool: True if the files were replaced, False if failed
+    """
+    # A request must not create the averages of a policy while the files are swapped
+    with _station_lock(station_id):
+        return _refresh_station_files(station_id)
+
+
+def _refresh_station_files(station_id):
+    """
+    Replaces the files of a station, see refresh_station_files().
+    """
+    staging_dir = f"{STATION_DIR}/.staging"
+    policies = [qc_policy for qc_policy in QC_POLICIES
+                if os.path.exists(station_file(station_id, 'yearly', qc_policy))]
+
+    success = download_station_data(station_id, staging_dir) and clean_station_data(station_id, staging_dir)
+    for qc_policy in policies:
+        success = (success and
+                   create_monthly_averages(station_id, qc_policy, staging_dir) and
+                   create_yearly_averages(station_id, qc_policy, staging_dir) and
+                   create_seasonal_sums(station_id, qc_policy, staging_dir))
+
+    staged_files = glob.glob(f"{staging_dir}/{station_id}*.csv")
+    with _cache_lock:
+        # Only swap the files in if the station wasn't removed from the cache in the meantime,
+        # the cache lock keeps it from being removed while the files are moved
+        success = success and os.path.exists(station_file(station_id, 'raw'))
+        if success:
+            # Move the raw file last, it is the one that marks a station as downloaded
+            for staged_file in sorted(staged_files, key=lambda f: f.endswith(f"{station_id}.csv")):
+                os.replace(staged_file, f"{STATION_DIR}/{os.path.basename(staged_file)}")
+    if success:
+        if SHARED_STATION_CACHE:
+            remove_stale_blocks(STATION_DIR)
+        update_station_coverage(station_id, station_file(station_id, 'raw'))
+    else:
+        for staged_file in staged_files:
+            os.remove(staged_file)
+    return success
+
+
+def iter_station_chunks(station_id, kind, year_from, year_to, qc_policy='none', chunksize=50000, file=None):
+    """
+    Reads a station file in chunks and yields the rows of the selected years.
+    Only one chunk is held in memory at a time.
+
+    Args:
+        station_id (str): The station ID
+        kind (str): One of 'raw', 'monthly', 'yearly' or 'seasonal'
+        year_from (int): First year to include
+        year_to (int): Last year to include
+        qc_policy (str): Quality control policy; for 'raw' the rejected values are left out
+        chunksize (int): Number of rows read at once
+        file (file object): The opened station file, read instead of opening it by its path
+
+    Yields:
+        pd.DataFrame: The rows of one chunk within the year range
+    """
+    source = file if file is not None else station_file(station_id, kind, qc_policy)
+    if kind == 'raw':
+        chunks = read_station_raw(source, chunksize=chunksize)
+    else:
+        chunks = pd.read_csv(source, chunksize=chunksize)
+    for chunk in chunks:
+        chunk = chunk[(chunk['Year'] >= year_from) & (chunk['Year'] <= year_to)]
+        if kind == 'raw' and qc_policy != 'none':
+            chunk = chunk[qc_mask(chunk, qc_policy)]
+        if not chunk.empty:
+            yield chunk
+
+
+@lru_cache(maxsize=32)
+def _read_station_file(path, mtime):
+    """
+    Reads the averages of a station. The modification time is part of the
+    cache key, so a file that was written again is read again.
+    """
+    return pd.read_csv(path)
+
+
+def load_station_frame(station_id, kind, qc_policy='none', usecols=None):
+    """
+    Loads a station file. The averages are kept in a cache: in shared memory for all
+    server processes (see 'shared_arrays.py') or in an in-process cache. The raw file
+    can be hundreds of MB for long records, so it is read from disk every time and
+    only the results built from it are cached (see load_time_series()).
+    The returned DataFrame of the averages is shared between calls and must not be changed.
+
+    Args:
+        station_id (str): The station ID
+        kind (str): One of 'raw', 'monthly', 'yearly' or 'seasonal'
+        qc_policy (str): Quality control policy; for 'raw' the rejected values are left out
+        usecols (list): Columns of the raw file to read, all if None
+
+    Returns:
+        pd.DataFrame: The content of the file
+    """
+    path = station_file(station_id, kind, qc_policy)
+    if kind == 'raw':
+        if usecols is not None and qc_policy != 'none':
+            usecols = list(dict.fromkeys(list(usecols) + ['QFlag']))
+        df = read_station_raw(path, usecols=usecols)
+        if qc_policy != 'none':
+            df = df[qc_mask(df, qc_policy)]
+        return df
+    if SHARED_STATION_CACHE:
+        return load_shared_frame(path)
+    return _read_station_file(path, os.path.getmtime(path))
+
+
+@lru_cache(maxsize=16)
+def _time_series(station_id, resolution, qc_policy, mtime):
+    """
+    Builds the TMAX and TMIN time series of a station, see load_time_series().
+    Only these arrays are cached, not the DataFrame of the raw file.
+    """
+    if resolution == 'daily':
+        df = load_station_frame(station_id, 'raw', qc_policy, usecols=['Year', 'Month', 'Day', 'Element', 'Value'])
+        df = df.pivot_table(index=['Year', 'Month', 'Day'], columns='Element', values='Value').reset_index()
+    else:
+        df = load_station_frame(station_id, 'monthly', qc_policy).assign(Day=15)
+
+    # Invalid dates (e.g. from broken lines) are left out
+    dates = pd.to_datetime(df[['Year', 'Month', 'Day']], errors='coerce').values
+    valid = ~np.isnat(dates)
+    df, dates = df[valid], dates[valid]
+    order = np.argsort(dates)
+    return {
+        'dates': dates[order],
+        'TMAX': df.reindex(columns=['TMAX'])['TMAX'].values[order].astype(float),
+        'TMIN': df.reindex(columns=['TMIN'])['TMIN'].values[order].astype(float)
+    }
+
+
+def load_time_series(station_id, resolution, qc_policy='none'):
+    """
+    Returns the daily or monthly TMAX and TMIN values of a station as sorted arrays.
+    The result is cached until the station file changes.
+
+    Args:
+        station_id (str): The station ID
+        resolution (str): 'daily' or 'monthly'
+        qc_policy (str): Quality control policy of the values
+
+    Returns:
+        dict: 'dates' (datetime64 array), 'TMAX' and 'TMIN' (float arrays, NaN if missing)
+    """
+    kind = 'raw' if resolution == 'daily' else 'monthly'
+    mtime = os.path.getmtime(station_file(station_id, kind, qc_policy))
+    return _time_series(station_id, resolution, qc_policy, mtime)
@@ -0,0 +1,434 @@
+import pandas as pd
+import numpy as np
+import os
+import tarfile
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl, only the threads of one process are synchronized there
+    fcntl = None
+
+from http_client import STATION_BASE_URL, catalog_url, open_stream, remote_modified_time
+
+# The 'year_coverage.py' module stores for every station in which years it has TMAX and TMIN data,
+# as one bit per year (a bitset of COVERAGE_YEARS bits packed into bytes).
+# The search can then check "at least X% of the years in the selected period" for the whole
+# catalog at once with a bitwise AND and a popcount, instead of only comparing
+# FirstYear/LastYear, which can't see gaps.
+#
+# Where the exact years come from (COVERAGE_SOURCE):
+#   'dly'      The '.dly' files of a local mirror (GHCN_BASE_URL=file://...), read when the
+#              catalog is built. Only the first 21 characters of every line are needed.
+#   'archive'  The bulk archive 'ghcnd_all.tar.gz' (all '.dly' files, a few GB), streamed once
+#              without storing it on disk. This takes a while, so the refresher runs it in the
+#              background after the catalog was built, and again when the archive is more than
+#              COVERAGE_ARCHIVE_DAYS days newer than the last run. Only used if set explicitly.
+#   'spans'    No exact years, only the inventory.
+#   'auto'     'dly' for a local mirror, otherwise 'spans' (default).
+# Until a station's exact years are known, its bitset is filled from the inventory (every
+# year between FirstYear and LastYear) and marked as estimated ('measured' is False).
+# Every downloaded station updates its own bitset with the exact years from its data.
+
+COVERAGE_FILE = "./data/station_coverage.npz"
+
+COVERAGE_SOURCE = os.environ.get('COVERAGE_SOURCE', 'auto')
+COVERAGE_ARCHIVE_DAYS = float(os.environ.get('COVERAGE_ARCHIVE_DAYS', 30))
+
+COVERAGE_ARCHIVE = "ghcnd_all.tar.gz"
+
+# Years covered by the bitsets
+COVERAGE_FIRST_YEAR = 1750
+COVERAGE_YEARS = 288  # up to 2037, a multiple of 8
+COVERAGE_BYTES = COVERAGE_YEARS // 8
+
+# A year counts as covered if this many months have TMAX and TMIN values
+MIN_MONTHS_PER_YEAR = 10
+
+# Number of set bits for every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint16)
+
+# Stations downloaded at the same time update the file one after the other
+_update_lock = threading.Lock()
+
+
+class _CoverageLock:
+    """
+    Lock shared by all threads and processes, protects reading, changing and
+    saving the coverage file, so no update of another process is lost.
+    """
+
+    def __init__(self, coverage_file):
+        self.lock_file = f"{coverage_file}.lock"
+
+    def __enter__(self):
+        _update_lock.acquire()
+        if fcntl is not None:
+            try:
+                self.file = open(self.lock_file, 'a')
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+            except BaseException:
+                _update_lock.release()
+                raise
+        return self
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+        _update_lock.release()
+
+
+def coverage_source():
+    """
+    Returns the source of the exact years, see COVERAGE_SOURCE.
+    """
+    if COVERAGE_SOURCE != 'auto':
+        return COVERAGE_SOURCE
+    return 'dly' if urlparse(STATION_BASE_URL).scheme == 'file' else 'spans'
+
+
+def coverage_from_spans(first_years, last_years):
+    """
+    Creates bitsets with every year between the first and the last year set.
+
+    Args:
+        first_years (array-like): First year of every station
+        last_years (array-like): Last year of every station
+
+    Returns:
+        np.ndarray: uint8 array of shape (stations, COVERAGE_BYTES)
+    """
+    years = np.arange(COVERAGE_FIRST_YEAR, COVERAGE_FIRST_YEAR + COVERAGE_YEARS)
+    first_years = np.asarray(first_years, dtype=float)[:, None]
+    last_years = np.asarray(last_years, dtype=float)[:, None]
+    return np.packbits((years >= first_years) & (years <= last_years), axis=1)
+
+
+def coverage_from_years(years):
+    """
+    Creates the bitset of one station from its covered years.
+
+    Args:
+        years (array-like): The covered years
+
+    Returns:
+        np.ndarray: uint8 array of length COVERAGE_BYTES
+    """
+    positions = np.asarray(years, dtype=int) - COVERAGE_FIRST_YEAR
+    positions = positions[(positions >= 0) & (positions < COVERAGE_YEARS)]
+    bits = np.zeros(COVERAGE_YEARS, dtype=bool)
+    bits[positions] = True
+    return np.packbits(bits)
+
+
+def _covered_years(months_df):
+    """
+    Returns the years with at least MIN_MONTHS_PER_YEAR months that have TMAX and TMIN.
+    months_df has one row per (Year, Month, Element) with data.
+    """
+    elements_per_month = months_df.drop_duplicates().groupby(['Year', 'Month'])['Element'].nunique()
+    complete_months = elements_per_month[elements_per_month == 2].reset_index()
+    months_per_year = complete_months.groupby('Year').size()
+    return months_per_year[months_per_year >= MIN_MONTHS_PER_YEAR].index.values
+
+
+def coverage_from_station_file(raw_file):
+    """
+    Creates the bitset of a station from its cleaned raw file.
+
+    Args:
+        raw_file (str): Path of the station's CSV file
+
+    Returns:
+        np.ndarray: uint8 array of length COVERAGE_BYTES
+    """
+    months_df = pd.read_csv(raw_file, usecols=['Year', 'Month', 'Element'])
+    return coverage_from_years(_covered_years(months_df))
+
+
+def coverage_from_dly_lines(lines):
+    """
+    Creates the bitset of a station from the lines of its '.dly' file. Only the first
+    21 characters of every line (station, year, month, element) are used.
+
+    Args:
+        lines (iterable): The lines as bytes
+
+    Returns:
+        np.ndarray: uint8 array of length COVERAGE_BYTES
+    """
+    # Elements of every month: 1 for TMAX, 2 for TMIN, 3 for both
+    months = {}
+    for line in lines:
+        element = line[17:21]
+        if element == b'TMAX' or element == b'TMIN':
+            month = line[11:17]
+            months[month] = months.get(month, 0) | (1 if element == b'TMAX' else 2)
+
+    complete_months = Counter(int(month[:4]) for month, elements in months.items() if elements == 3)
+    return coverage_from_years([year for year, count in complete_months.items() if count >= MIN_MONTHS_PER_YEAR])
+
+
+def coverage_from_dly(dly_file):
+    """
+    Creates the bitset of a station from a '.dly' file.
+
+    Args:
+        dly_file (str): Path of the '.dly' file
+
+    Returns:
+        np.ndarray: uint8 array of length COVERAGE_BYTES
+    """
+    with open(dly_file, 'rb') as f:
+        return coverage_from_dly_lines(f)
+
+
+def coverage_from_archive(station_ids, url=None):
+    """
+    Reads the exact years of the stations from the bulk archive of all '.dly' files.
+    The archive is streamed, only one station file is held in memory at a time.
+
+    Args:
+        station_ids (array-like): IDs of the stations
+        url (str): URL of the archive, COVERAGE_ARCHIVE of the source if None
+
+    Returns:
+        tuple: (bitsets as uint8 array of shape (stations, COVERAGE_BYTES),
+                bool array, True for the stations found in the archive)
+    """
+    positions = {station_id: i for i, station_id in enumerate(station_ids)}
+    bits = np.zeros((len(positions), COVERAGE_BYTES), dtype=np.uint8)
+    found = np.zeros(len(positions), dtype=bool)
+
+    with open_stream(url or catalog_url(COVERAGE_ARCHIVE)) as stream:
+        with tarfile.open(fileobj=stream, mode='r|gz') as archive:
+            for member in archive:
+                if not member.isfile() or not member.name.endswith('.dly'):
+                    continue
+                position = positions.get(os.path.basename(member.name)[:-len('.dly')])
+                if position is None:
+                    continue
+                bits[position] = coverage_from_dly_lines(archive.extractfile(member).read().split(b'\n'))
+                found[position] = True
+    return bits, found
+
+
+def build_catalog_coverage(stations_df):
+    """
+    Creates the bitsets for the whole catalog: from the '.dly' files of a local mirror
+    if the source is 'dly', otherwise from FirstYear and LastYear (estimated).
+
+    Args:
+        stations_df (pd.DataFrame): The station catalog
+
+    Returns:
+        tuple: (uint8 array of shape (stations, COVERAGE_BYTES),
+                bool array, True for the stations with exact years)
+    """
+    bits = coverage_from_spans(stations_df['FirstYear'], stations_df['LastYear'])
+    measured = np.zeros(len(stations_df), dtype=bool)
+
+    if coverage_source() == 'dly' and urlparse(STATION_BASE_URL).scheme == 'file':
+        dly_dir = url2pathname(urlparse(STATION_BASE_URL).path)
+        for i, station_id in enumerate(stations_df['Station_ID']):
+            dly_file = os.path.join(dly_dir, f"{station_id}.dly")
+            if os.path.exists(dly_file):
+                bits[i] = coverage_from_dly(dly_file)
+                measured[i] = True
+        print(f"Read the year coverage of {measured.sum()} of {len(stations_df)} stations from {dly_dir}")
+
+    return bits, measured
+
+
+def save_coverage(station_ids, bits, measured, coverage_file=COVERAGE_FILE, archive_time=None):
+    """
+    Saves the bitsets of all stations. The file is replaced atomically.
+
+    Args:
+        station_ids (array-like): IDs of the stations
+        bits (np.ndarray): uint8 array of shape (stations, COVERAGE_BYTES)
+        measured (np.ndarray): True for the stations with exact years
+        coverage_file (str): Path of the coverage file
+        archive_time (float): Modification time of the archive the years were read from
+    """
+    # Every process and thread writes its own temporary file
+    temp_file = f"{coverage_file}.{os.getpid()}.{threading.get_ident()}.part.npz"
+    try:
+        np.savez(temp_file, station_ids=np.asarray(station_ids, dtype=str), bits=bits,
+                 measured=np.asarray(measured, dtype=bool),
+                 archive_time=np.float64(np.nan if archive_time is None else archive_time))
+        os.replace(temp_file, coverage_file)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def _load_stored(coverage_file):
+    """
+    Reads the coverage file. Files of older versions don't have 'measured'
+    (all estimated) and 'archive_time'.
+    """
+    with np.load(coverage_file) as stored:
+        station_ids, bits = stored['station_ids'], stored['bits']
+        measured = stored['measured'] if 'measured' in stored else np.zeros(len(station_ids), dtype=bool)
+        archive_time = float(stored['archive_time']) if 'archive_time' in stored else np.nan
+    return station_ids, bits, measured, (None if np.isnan(archive_time) else archive_time)
+
+
+def load_coverage(stations_df, coverage_file=COVERAGE_FILE):
+    """
+    Loads the bitsets in the order of the catalog. Stations without a stored bitset
+    get an estimated one from their FirstYear and LastYear.
+
+    Args:
+        stations_df (pd.DataFrame): The station catalog
+        coverage_file (str): Path of the coverage file
+
+    Returns:
+        tuple: (uint8 array of shape (stations, COVERAGE_BYTES),
+                bool array, True for the stations with exact years)
+    """
+    bits = coverage_from_spans(stations_df['FirstYear'], stations_df['LastYear'])
+    measured = np.zeros(len(stations_df), dtype=bool)
+    if os.path.exists(coverage_file):
+        station_ids, stored_bits, stored_measured, _ = _load_stored(coverage_file)
+        positions = pd.Index(station_ids).get_indexer(stations_df['Station_ID'])
+        found = positions >= 0
+        bits[found] = stored_bits[positions[found]]
+        measured[found] = stored_measured[positions[found]]
+    return bits, measured
+
+
+def rebuild_catalog_coverage(stations_df, coverage_file=COVERAGE_FILE, output_file=None):
+    """
+    Creates the bitsets for a new catalog and keeps the exact years that are already
+    known for its stations (from the archive or from downloaded stations).
+
+    Args:
+        stations_df (pd.DataFrame): The new station catalog
+        coverage_file (str): Path of the current coverage file
+        output_file (str): Path the new coverage is written to, coverage_file if None
+    """
+    bits, measured = build_catalog_coverage(stations_df)
+    archive_time = None
+    if os.path.exists(coverage_file):
+        old_bits, old_measured = load_coverage(stations_df, coverage_file)
+        keep = old_measured & ~measured
+        bits[keep] = old_bits[keep]
+        measured |= old_measured
+        archive_time = _load_stored(coverage_file)[3]
+    save_coverage(stations_df['Station_ID'], bits, measured, output_file or coverage_file, archive_time)
+
+
+def update_station_coverage(station_id, raw_file, coverage_file=COVERAGE_FILE):
+    """
+    Replaces the bitset of one station with the exact years from its downloaded data.
+    Errors are only printed, the station itself is usable without its exact years.
+
+    Args:
+        station_id (str): The station ID
+        raw_file (str): Path of the station's cleaned CSV file
+        coverage_file (str): Path of the coverage file
+
+    Returns:
+        bool: True if the coverage file was updated
+    """
+    if not os.path.exists(coverage_file):
+        return False
+    try:
+        station_bits = coverage_from_station_file(raw_file)
+        with _CoverageLock(coverage_file):
+            station_ids, bits, measured, archive_time = _load_stored(coverage_file)
+            position = np.flatnonzero(station_ids == station_id)
+            if len(position) == 0 or (measured[position[0]] and np.array_equal(bits[position[0]], station_bits)):
+                return False
+            bits, measured = bits.copy(), measured.copy()
+            bits[position[0]] = station_bits
+            measured[position[0]] = True
+            save_coverage(station_ids, bits, measured, coverage_file, archive_time)
+        return True
+    except Exception as e:
+        print(f"Error updating the year coverage of station {station_id}: {e}")
+        return False
+
+
+def update_archive_coverage(coverage_file=COVERAGE_FILE, force=False):
+    """
+    Reads the exact years of all catalog stations from the bulk archive if the source
+    is 'archive' and the last run is missing or older than COVERAGE_ARCHIVE_DAYS
+    (and the archive changed since then).
+
+    Args:
+        coverage_file (str): Path of the coverage file
+        force (bool): Read the archive even if the last run is recent
+
+    Returns:
+        bool: True if the coverage file was updated
+    """
+    if coverage_source() != 'archive' or not os.path.exists(coverage_file):
+        return False
+    station_ids, _, _, archive_time = _load_stored(coverage_file)
+    if not force and archive_time is not None and time.time() - archive_time < COVERAGE_ARCHIVE_DAYS * 86400:
+        return False
+    url = catalog_url(COVERAGE_ARCHIVE)
+    remote_time = remote_modified_time(url)
+    if not force and archive_time is not None and remote_time is not None and remote_time <= archive_time:
+        return False
+
+    print(f"Reading the year coverage of {len(station_ids)} stations from {url}")
+    read_ids = station_ids
+    archive_bits, found = coverage_from_archive(read_ids, url)
+
+    # The file may have changed in the meantime (downloaded stations, new catalog)
+    with _CoverageLock(coverage_file):
+        station_ids, bits, measured, _ = _load_stored(coverage_file)
+        positions = pd.Index(read_ids).get_indexer(station_ids)
+        update = positions >= 0
+        update[update] = found[positions[update]]
+        bits, measured = bits.copy(), measured.copy()
+        bits[update] = archive_bits[positions[update]]
+        measured[update] = True
+        save_coverage(station_ids, bits, measured, coverage_file, remote_time or time.time())
+    print(f"Read the exact years of {update.sum()} of {len(station_ids)} stations from the archive")
+    return True
+
+
+def window_mask(year_from, year_to):
+    """
+    Creates the bitset of a year window.
+
+    Returns:
+        tuple: (mask as uint8 array, number of years of the window within the bitset)
+    """
+    years = np.arange(max(year_from, COVERAGE_FIRST_YEAR),
+                      min(year_to, COVERAGE_FIRST_YEAR + COVERAGE_YEARS - 1) + 1)
+    return coverage_from_years(years), len(years)
+
+
+def covered_years(bits, year_from, year_to):
+    """
+    Counts for every station the covered years within a window.
+
+    Args:
+        bits (np.ndarray): uint8 array of shape (stations, COVERAGE_BYTES)
+        year_from (int): First year of the window
+        year_to (int): Last year of the window
+
+    Returns:
+        tuple: (covered years per station, number of years of the window)
+    """
+    mask, n_years = window_mask(year_from, year_to)
+    return POPCOUNT[bits & mask].sum(axis=1), n_years
+
+
+# Run 'python year_coverage.py' to read the exact years from the bulk archive now
+if __name__ == '__main__':
+    if update_archive_coverage(force=True):
+        print(f"Saved the year coverage to {COVERAGE_FILE}")
+    else:
+        print(f"Nothing to do, the source is '{coverage_source()}' or {COVERAGE_FILE} doesn't exist")